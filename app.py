@@ -1,7 +1,15 @@
+import asyncio
+import functools
+import hashlib
+import logging
 import os
+import uuid
+from collections import OrderedDict
 import chainlit as cl
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.memory import MemorySaver
 from typing import (
     TypedDict,
     Annotated,
@@ -9,16 +17,27 @@ from typing import (
     Optional,
     Dict,
     Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Tuple,
+    Union,
 )
 
 # import requests # requestsは不要になった
-from dotenv import load_dotenv
-import json
+from env_utils import load_env_once
+from log_utils import setup_queue_logging
 import httpx
+import orjson
 from github_client import GitHubClient
+from token_batcher import TokenBatcher
 
 # .envファイルから環境変数を読み込む
-load_dotenv()
+load_env_once()
+
+# APP_DEBUG=1 のときはデバッグログ (グラフ遷移や各ステップの出力) も出力する
+logger = logging.getLogger(__name__)
+_LOG_LISTENER = setup_queue_logging(__name__, "github_client")
 
 # --- Dify API Keys ---
 PLANNING_APP_API_KEY = os.getenv("PLANNING_APP_API_KEY")
@@ -36,24 +55,62 @@ if GITHUB_PROJECT_NUMBER_STR:
     try:
         GITHUB_PROJECT_NUMBER = int(GITHUB_PROJECT_NUMBER_STR)
     except ValueError:
-        print("Warning: GITHUB_PROJECT_NUMBER is not a valid integer.")
+        logger.warning("GITHUB_PROJECT_NUMBER is not a valid integer.")
+
+# Issue本文生成の同時実行数の上限
+ISSUE_GENERATION_CONCURRENCY = 8
+# GitHubへのIssue発行の同時実行数の上限 (セカンダリレート制限を考慮して小さめ)
+GITHUB_PUBLISH_CONCURRENCY = 4
+# 1回のGraphQLミューテーションでまとめて作成するIssueの数
+GITHUB_BATCH_SIZE = 20
 
 # --- API Endpoints ---
 DIFY_API_ENDPOINT = "http://localhost/v1/chat-messages"
+COMPLETION_API_ENDPOINT = "http://localhost/v1/completion-messages"
+
+# Dify への接続で HTTP/2 を使うか (ゲートウェイが未対応の場合は DIFY_HTTP2=0 で HTTP/1.1 に戻す)
+DIFY_HTTP2 = os.getenv("DIFY_HTTP2", "1") != "0"
+
+# Dify呼び出しで使い回すHTTPクライアント (接続プールを共有し、HTTP/2 では並列ストリームを1接続に多重化する)
+_DIFY_CLIENT = httpx.AsyncClient(
+    http2=DIFY_HTTP2,
+    timeout=httpx.Timeout(300.0, connect=10.0),
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+)
+
+
+# 対話履歴として保持するメッセージ数の上限
+# (Dify側は conversation_id で会話を保持しているため、直近のみで十分)
+MAX_CONVERSATION_HISTORY = 20
+
+
+def _trim_history(history: List[BaseMessage]) -> List[BaseMessage]:
+    """対話履歴を直近 MAX_CONVERSATION_HISTORY 件に切り詰める"""
+    return history[-MAX_CONVERSATION_HISTORY:]
+
+
+def _add_history(
+    left: List[BaseMessage], right: List[BaseMessage]
+) -> List[BaseMessage]:
+    """対話履歴のreducer。結合した上で上限件数に切り詰める"""
+    return _trim_history(left + right)
 
 
 # LangGraphの状態を定義
 class AppState(TypedDict):
     initial_query: str  # ユーザーの最初の入力
     plan_conversation_history: Annotated[
-        List[BaseMessage], lambda x, y: x + y
+        List[BaseMessage], _add_history
     ]  # 企画アプリの対話履歴
     plan_output: str  # 企画アプリの最終出力 (企画書)
+    plan_conversation_id: str  # 企画アプリのDify会話ID
     spec_conversation_history: Annotated[
-        List[BaseMessage], lambda x, y: x + y
+        List[BaseMessage], _add_history
     ]  # 仕様アプリの対話履歴
     spec_output: str  # 仕様アプリの最終出力 (技術仕様書)
+    spec_conversation_id: str  # 仕様アプリのDify会話ID
     task_output: str  # タスク分解アプリの出力
+    task_list: List[str]  # task_output を解析したタスク名のリスト
     issue_output: List[Dict[str, str]]  # Issue辞書のリスト
     github_project_id: Optional[str]  # GitHub Project V2 の Node ID
     created_issues: List[Dict[str, Any]]  # 作成されたIssueの情報リスト
@@ -62,7 +119,92 @@ class AppState(TypedDict):
     error_message: Optional[str]  # エラーメッセージ (Optionalに変更)
 
 
+# --- SSEストリームの読み出し ---
+# SSE の仕様上、"data:" の直後の空白1つは省略可能
+_DATA_PREFIX = b"data:"
+_DATA_OFFSET = len(_DATA_PREFIX)
+_SPACE = 0x20
+# 回答の断片を含むイベント
+_MESSAGE_EVENTS = frozenset(("agent_message", "message"))
+
+
+def _sse_data_payload(buf: bytes, start: int, end: int) -> Optional[bytes]:
+    """buf[start:end] の1行が data: 行であればペイロードを返す"""
+    # CRLF の場合は CR を除いた位置までをペイロードとする
+    if end > start and buf[end - 1] == 0x0D:
+        end -= 1
+    if not buf.startswith(_DATA_PREFIX, start, end):
+        return None
+    start += _DATA_OFFSET
+    if start < end and buf[start] == _SPACE:
+        start += 1
+    return buf[start:end]
+
+
+async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[bytes]:
+    """SSEレスポンスをバイト列のまま行に分割し、data: 行のペイロードを返す
+
+    受信したチャンクはそのまま走査し、チャンクをまたぐ行の断片だけをリストに溜めて
+    行末を受信した時点で一度だけ結合する (受信済みのデータを再走査しない)。
+    """
+    pending: List[bytes] = []  # 改行をまだ受信していない行の断片
+    async for chunk in response.aiter_bytes():
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            if pending:
+                pending.append(chunk[start:end])
+                line = b"".join(pending)
+                pending.clear()
+                payload = _sse_data_payload(line, 0, len(line))
+            else:
+                payload = _sse_data_payload(chunk, start, end)
+            if payload is not None:
+                yield payload
+            start = end + 1
+        if start < len(chunk):
+            pending.append(chunk[start:] if start else chunk)
+    # 改行で終わらない最終行
+    if pending:
+        line = b"".join(pending)
+        payload = _sse_data_payload(line, 0, len(line))
+        if payload is not None:
+            yield payload
+
+
 # --- Dify API呼び出し関数 ---
+# 実行中の呼び出し (同一リクエストの同時実行を1回にまとめる)
+_INFLIGHT_COMPLETIONS: Dict[bytes, "asyncio.Future[Dict[str, Any]]"] = {}
+
+
+def _request_key(api_key: str, body: bytes) -> bytes:
+    """APIキーとシリアライズ済みのリクエストから、同一リクエストを判定するキーを作る"""
+    return hashlib.blake2b(api_key.encode() + body, digest_size=16).digest()
+
+
+async def _single_flight(
+    inflight: Dict[bytes, "asyncio.Future[Dict[str, Any]]"],
+    key: bytes,
+    request: Callable[[], Awaitable[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """同じキーの呼び出しが実行中であればその結果を待ち、なければ request を実行する"""
+    future = inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(request())
+        inflight[key] = future
+        future.add_done_callback(lambda _: inflight.pop(key, None))
+    # 呼び出し元の1つがキャンセルされても、共有している他の呼び出し元には影響させない
+    return dict(await asyncio.shield(future))
+
+
+@functools.lru_cache(maxsize=None)
+def _dify_headers(api_key: str) -> Dict[str, str]:
+    """APIキーごとのリクエストヘッダー (呼び出し側で変更しないこと)"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+
+
 async def call_dify_api(
     api_key: str,
     query: str,
@@ -70,8 +212,12 @@ async def call_dify_api(
     inputs: Optional[Dict[str, Any]] = None,  # inputsをOptionalに
     history: Optional[List[BaseMessage]] = None,  # historyをOptionalに
     user: str = "chainlit-user",
+    on_answer: Optional[Callable[[str], Awaitable[Any]]] = None,
 ) -> Dict[str, Any]:  # 戻り値の型ヒントを修正
-    """Dify APIを呼び出す共通関数 (ストリーミング対応)"""
+    """Dify APIを呼び出す共通関数 (ストリーミング対応)
+
+    on_answer を指定すると、回答の断片を受信するたびに呼び出す。
+    """
     if not api_key:
         return {
             "answer": "",
@@ -79,10 +225,6 @@ async def call_dify_api(
             "error": "API key is missing.",
         }
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
     payload: Dict[str, Any] = {  # payloadの型ヒント
         "inputs": inputs if inputs else {},
         "query": query,
@@ -91,124 +233,193 @@ async def call_dify_api(
         "user": user,
         "files": [],
     }
+    body = orjson.dumps(payload)
+    return await _request_chat(api_key, body, conversation_id, on_answer)
+
 
-    full_response_content = ""
+async def _request_chat(
+    api_key: str,
+    body: bytes,
+    conversation_id: str,
+    on_answer: Optional[Callable[[str], Awaitable[Any]]] = None,
+) -> Dict[str, Any]:
+    """シリアライズ済みのリクエストを Chat API に送信し、回答を結合して返す"""
+    headers = _dify_headers(api_key)
+    answer_parts: List[str] = []
     conversation_id_out = conversation_id  # レスポンスから取得できれば更新
 
-    # httpx.AsyncClientを直接使用
-    async with httpx.AsyncClient() as client:
-        async with client.stream(
-            "POST", DIFY_API_ENDPOINT, headers=headers, json=payload, timeout=300
-        ) as response:
-            response.raise_for_status()  # エラーチェック
-            async for line in response.aiter_lines():  # httpxのストリーム処理
-                if line:
-                    # decoded_line = line.decode("utf-8") # aiter_lines はデコード済み
-                    if line.startswith("data:"):
-                        try:
-                            data_str = line[len("data: ") :]
-                            if not data_str:  # 空のdata行をスキップ
-                                continue
-                            data = json.loads(data_str)
-                            event = data.get("event")
-                            if event == "agent_message" or event == "message":
-                                full_response_content += data.get("answer", "")
-                            elif event == "message_end":
-                                conversation_id_out = data.get(
-                                    "conversation_id", conversation_id_out
-                                )
-                                # 他のメタデータが必要な場合はここで取得
-                        except json.JSONDecodeError:
-                            print(f"Failed to decode JSON: {data_str}")
-                            # エラー処理が必要な場合
-                        except Exception as e:
-                            print(f"Error processing stream data: {e}")
-                            # その他のエラー処理
+    # 共有のhttpx.AsyncClientを使用 (接続を再利用する)
+    async with _DIFY_CLIENT.stream(
+        "POST", DIFY_API_ENDPOINT, headers=headers, content=body
+    ) as response:
+        response.raise_for_status()  # エラーチェック
+        async for data_bytes in _iter_sse_data(response):  # data: 行のペイロード
+            if not data_bytes:  # 空のdata行をスキップ
+                continue
+            try:
+                data = orjson.loads(data_bytes)
+                event = data.get("event")
+                if event in _MESSAGE_EVENTS:
+                    answer = data.get("answer")
+                    if answer:
+                        answer_parts.append(answer)
+                        if on_answer is not None:
+                            await on_answer(answer)
+                elif event == "message_end":
+                    conversation_id_out = data.get(
+                        "conversation_id", conversation_id_out
+                    )
+                    # 他のメタデータが必要な場合はここで取得
+            except orjson.JSONDecodeError:
+                logger.warning("Failed to decode JSON: %r", data_bytes)
+                # エラー処理が必要な場合
+            except Exception as e:
+                logger.warning("Error processing stream data: %s", e)
+                # その他のエラー処理
 
     return {
-        "answer": full_response_content,
+        "answer": "".join(answer_parts),
         "conversation_id": conversation_id_out,
         "error": None,
     }
 
 
 # --- Dify API呼び出し関数 (Completion用) ---
+# 成功した Completion API の応答 (LRU)。DIFY_RESPONSE_CACHE=0 で無効化する
+DIFY_RESPONSE_CACHE = os.getenv("DIFY_RESPONSE_CACHE", "1") != "0"
+COMPLETION_CACHE_SIZE = 256
+_COMPLETION_CACHE: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+
+
 async def call_completion_api(
     api_key: str,
-    inputs: Dict[str, Any],  # inputsの型ヒント
+    inputs: Union[Dict[str, Any], orjson.Fragment],  # inputsの型ヒント
     user: str = "chainlit-user",
+    on_answer: Optional[Callable[[str], Awaitable[Any]]] = None,
 ) -> Dict[str, Any]:  # 戻り値の型ヒントを修正
-    """Dify Completion APIを呼び出す関数 (ストリーミング対応)"""
+    """Dify Completion APIを呼び出す関数 (ストリーミング対応)
+
+    inputs にはシリアライズ済みのJSONを orjson.Fragment で渡すこともできる。
+
+    on_answer を指定すると、回答の断片を受信するたびに呼び出す。
+    on_answer を指定しない場合、同じ内容の呼び出しが実行中であればその結果を共有する。
+    同じ内容の呼び出しに成功済みであれば、APIを呼ばずにその応答を返す。
+    """
     if not api_key:
         return {"answer": "", "error": "API key is missing."}
 
-    COMPLETION_API_ENDPOINT = "http://localhost/v1/completion-messages"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
     payload: Dict[str, Any] = {  # payloadの型ヒント
         "inputs": inputs,
         "response_mode": "streaming",
         "user": user,
     }
+    body = orjson.dumps(payload)
+    key = _request_key(api_key, body)
+
+    if DIFY_RESPONSE_CACHE:
+        cached = _COMPLETION_CACHE.get(key)
+        if cached is not None:
+            _COMPLETION_CACHE.move_to_end(key)
+            if on_answer is not None:
+                await on_answer(cached["answer"])
+            return dict(cached)
+
+    if on_answer is not None:
+        result = await _request_completion(api_key, body, on_answer)
+    else:
+        result = await _single_flight(
+            _INFLIGHT_COMPLETIONS, key, lambda: _request_completion(api_key, body)
+        )
+
+    if DIFY_RESPONSE_CACHE and result.get("error") is None:
+        _COMPLETION_CACHE[key] = dict(result)
+        if len(_COMPLETION_CACHE) > COMPLETION_CACHE_SIZE:
+            _COMPLETION_CACHE.popitem(last=False)
+    return result
+
+
+async def _request_completion(
+    api_key: str,
+    body: bytes,
+    on_answer: Optional[Callable[[str], Awaitable[Any]]] = None,
+) -> Dict[str, Any]:
+    """シリアライズ済みのリクエストを Completion API に送信し、回答を結合して返す"""
+    headers = _dify_headers(api_key)
 
-    full_response_content = ""
+    answer_parts: List[str] = []
     # conversation_id は completion API のレスポンスに含まれない想定
     # conversation_id_out = ""
 
-    async with httpx.AsyncClient() as client:
-        try:
-            async with client.stream(
-                "POST",
-                COMPLETION_API_ENDPOINT,
-                headers=headers,
-                json=payload,
-                timeout=300,
-            ) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line and line.startswith("data:"):
-                        try:
-                            data_str = line[len("data: ") :]
-                            if not data_str:
-                                continue
-                            data = json.loads(data_str)
-                            event = data.get("event")
-                            # completion API のイベント名が異なる可能性あり
-                            # chat API と同じ 'agent_message'/'message' を想定
-                            if event == "agent_message" or event == "message":
-                                full_response_content += data.get("answer", "")
-                            # completion API の終了イベントも異なる可能性あり
-                            # elif event == "message_end":
-                            #     # conversation_id は通常ない
-                            #     pass
-                        except json.JSONDecodeError:
-                            print(f"Failed to decode JSON: {data_str}")
-                        except Exception as e:
-                            print(f"Error processing stream data: {e}")
-            return {
-                "answer": full_response_content,
-                # "conversation_id": conversation_id_out, # completion APIでは返らない
-                "error": None,
-            }
-        except httpx.HTTPStatusError as e:
-            print(f"HTTP error: {e.response.status_code} - {e.response.text}")
-            return {"answer": "", "error": f"HTTP error: {e.response.status_code}"}
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return {"answer": "", "error": str(e)}
+    try:
+        async with _DIFY_CLIENT.stream(
+            "POST",
+            COMPLETION_API_ENDPOINT,
+            headers=headers,
+            content=body,
+        ) as response:
+            response.raise_for_status()
+            async for data_bytes in _iter_sse_data(response):
+                if not data_bytes:
+                    continue
+                try:
+                    data = orjson.loads(data_bytes)
+                    event = data.get("event")
+                    # completion API のイベント名が異なる可能性あり
+                    # chat API と同じ 'agent_message'/'message' を想定
+                    if event in _MESSAGE_EVENTS:
+                        answer = data.get("answer")
+                        if answer:
+                            answer_parts.append(answer)
+                            if on_answer is not None:
+                                await on_answer(answer)
+                    # completion API の終了イベントも異なる可能性あり
+                    # elif event == "message_end":
+                    #     # conversation_id は通常ない
+                    #     pass
+                except orjson.JSONDecodeError:
+                    logger.warning("Failed to decode JSON: %r", data_bytes)
+                except Exception as e:
+                    logger.warning("Error processing stream data: %s", e)
+        return {
+            "answer": "".join(answer_parts),
+            # "conversation_id": conversation_id_out, # completion APIでは返らない
+            "error": None,
+        }
+    except httpx.HTTPStatusError as e:
+        logger.error("HTTP error: %s - %s", e.response.status_code, e.response.text)
+        return {"answer": "", "error": f"HTTP error: {e.response.status_code}"}
+    except Exception as e:
+        logger.error("An error occurred: %s", e)
+        return {"answer": "", "error": str(e)}
 
 
 # --- LangGraphノード関数 ---
+# 企画/仕様アプリの応答の接頭辞 (完了 / ユーザーへの質問)
+_END_PREFIX = "終了"
+_ASK_PREFIX = "質問"
+_RESPONSE_PREFIXES = (_END_PREFIX, _ASK_PREFIX)
+# 仕様アプリへの最初の問い合わせ (企画書を入力とする)
+_SPEC_BOOTSTRAP_QUERY = "以下の企画書に基づいて技術仕様を作成してください:\n\n{plan}"
+
+
+def _split_response_prefix(text: str) -> Tuple[Optional[str], str]:
+    """応答を接頭辞と本文に分ける。接頭辞がなければ (None, text) を返す"""
+    if not text.startswith(_RESPONSE_PREFIXES):
+        return None, text
+    # 2つの接頭辞は先頭の1文字で区別できる
+    kind = _END_PREFIX if text[0] == _END_PREFIX[0] else _ASK_PREFIX
+    return kind, text[len(kind) :].strip()
 
 
 async def github_publish_step(
     state: AppState,
 ) -> Dict[str, Any]:  # 戻り値の型ヒント修正
     """生成されたIssueをGitHubに発行し、プロジェクトに追加するステップ"""
-    print("--- GitHub Publish Step ---")
-    await cl.Message(content="GitHubへのIssue発行とプロジェクト追加を実行中...").send()
+    logger.info("--- GitHub Publish Step ---")
+    # 進捗は1つのメッセージに追記し、最後にまとめて更新する
+    progress = cl.Message(content="GitHubへのIssue発行とプロジェクト追加を実行中...")
+    await progress.send()
+    progress_lines: List[str] = []
 
     github_client: Optional[GitHubClient] = cl.user_session.get("github_client")
     # issue_output は List[Dict[str, str]] 型のはず
@@ -219,16 +430,16 @@ async def github_publish_step(
 
     if not github_client:
         return {
-            **state,
             "error_message": "GitHubクライアントが初期化されていません。",
+            "current_step": "github_publish",
             "next_step": "error",
         }
 
     if not issues_to_create:
-        await cl.Message(content="発行対象のIssueがありません。").send()
+        progress.content = "発行対象のIssueがありません。"
+        await progress.update()
         # issue_outputが空でもcreated_issuesは空リストで返す
         return {
-            **state,
             "created_issues": [],
             "current_step": "github_publish",
             "next_step": "end",
@@ -244,69 +455,119 @@ async def github_publish_step(
                     f"が見つかりません。Issueは作成されますが、プロジェクトには追加されません。"
                 )
                 errors.append(error_msg)
-                await cl.Message(content=error_msg).send()
+                progress_lines.append(error_msg)
             else:
                 cl.user_session.set(
                     "github_project_id", project_id
                 )  # セッション経由で更新
-                print(f"Fetched GitHub Project ID: {project_id}")
+                logger.info("Fetched GitHub Project ID: %s", project_id)
 
         except Exception as e:
             error_msg = f"GitHubプロジェクトID取得中にエラー: {e}"
-            print(error_msg)
+            logger.error(error_msg)
             errors.append(
                 error_msg + " Issueは作成されますが、プロジェクトには追加されません。"
             )
-            await cl.Message(content=errors[-1]).send()
+            progress_lines.append(errors[-1])
             project_id = None
     elif project_id:
         # 既に取得済みの場合はセッションから取得し直す（状態遷移で渡ってこない場合のため）
         project_id = cl.user_session.get("github_project_id")
 
     # Issueを作成し、プロジェクトに追加
-    for issue_data in issues_to_create:
-        title = issue_data.get("title", "タイトルなし")
-        body = issue_data.get("body", "")
-        try:
-            created_issue = await github_client.create_issue(title=title, body=body)
-            created_issues_list.append(created_issue)  # 作成成功したIssue情報を追加
-            issue_node_id = created_issue.get("node_id")
-            issue_number = created_issue.get("number")
-            issue_url = created_issue.get("html_url", "#")
-            await cl.Message(
-                content=f"Issue #{issue_number} を作成しました: {issue_url}"
-            ).send()
-
-            if project_id and issue_node_id:
-                item_id = await github_client.add_issue_to_project_v2(
-                    project_id, issue_node_id
-                )
-                # item_id が取得できた場合のみメッセージ表示
-                if item_id:
-                    await cl.Message(
-                        content=f"Issue #{issue_number} をプロジェクトに追加しました。"
-                    ).send()
-                else:  # item_id が取得できなかった場合 (add_issue_to_project_v2 が None を返した場合など)
-                    error_msg = (
-                        f"Issue #{issue_number} のプロジェクト追加に失敗しました。"
+    # GraphQLの1リクエストで複数のIssueをまとめて作成し、まとめてプロジェクトに追加する
+    semaphore = asyncio.Semaphore(GITHUB_PUBLISH_CONCURRENCY)
+
+    async def publish_batch(
+        batch: List[Dict[str, str]],
+    ) -> List[Tuple[Optional[Dict[str, Any]], Optional[str], Optional[Exception]]]:
+        async with semaphore:
+            try:
+                created = await github_client.create_issues_batch(batch)
+            except Exception as e:
+                return [(None, None, e)] * len(batch)
+
+            item_ids: List[Optional[str]] = [None] * len(batch)
+            node_ids = [issue["node_id"] for issue in created if issue]
+            if project_id and node_ids:
+                try:
+                    added = iter(
+                        await github_client.add_issues_to_project_batch(
+                            project_id, node_ids
+                        )
                     )
-                    errors.append(error_msg)
-                    await cl.Message(content=error_msg).send()
-            elif project_id and not issue_node_id:  # Issue Node ID がない場合
-                error_msg = (
-                    f"Issue #{issue_number} のNode IDが取得できず、"
-                    "プロジェクトに追加できませんでした。"
+                    item_ids = [next(added) if issue else None for issue in created]
+                except Exception as e:
+                    # Issueは作成済みのため、作成結果は返してプロジェクト追加の失敗として扱う
+                    logger.error("GitHubプロジェクトへの追加中にエラー: %s", e)
+
+            return [
+                (
+                    (issue, item_id, None)
+                    if issue
+                    else (None, None, RuntimeError("GitHubがIssueを返しませんでした。"))
                 )
-                errors.append(error_msg)
-                await cl.Message(content=error_msg).send()
-            # else: project_id がない場合は、そもそもこの if project_id and issue_node_id: ブロックに入らない
-
-        except Exception as e:
-            error_msg = f"Issue '{title}' の作成またはプロジェクト追加中にエラー: {e}"
-            print(error_msg)
+                for issue, item_id in zip(created, item_ids)
+            ]
+
+    batches = [
+        issues_to_create[i : i + GITHUB_BATCH_SIZE]
+        for i in range(0, len(issues_to_create), GITHUB_BATCH_SIZE)
+    ]
+    # 1つのバッチで予期しない例外が起きても、他のバッチで作成済みのIssueは報告する
+    batch_results = await asyncio.gather(
+        *(publish_batch(batch) for batch in batches), return_exceptions=True
+    )
+    results = [
+        result
+        for batch, batch_result in zip(batches, batch_results)
+        for result in (
+            [(None, None, batch_result)] * len(batch)
+            if isinstance(batch_result, BaseException)
+            else batch_result
+        )
+    ]
+
+    # 結果は発行対象の順序で処理する
+    for issue_data, (created_issue, item_id, error) in zip(issues_to_create, results):
+        if error is not None:
+            title = issue_data.get("title", "タイトルなし")
+            error_msg = f"Issue '{title}' の作成またはプロジェクト追加中にエラー: {error}"
+            logger.error(error_msg)
             errors.append(error_msg)
-            await cl.Message(content=error_msg).send()
+            progress_lines.append(error_msg)
             # 1つのIssueでエラーが起きても、他のIssueの処理は続ける
+            continue
+
+        created_issues_list.append(created_issue)  # 作成成功したIssue情報を追加
+        issue_node_id = created_issue.get("node_id")
+        issue_number = created_issue.get("number")
+        issue_url = created_issue.get("html_url", "#")
+        progress_lines.append(f"Issue #{issue_number} を作成しました: {issue_url}")
+
+        if project_id and issue_node_id:
+            # item_id が取得できた場合のみメッセージ表示
+            if item_id:
+                progress_lines.append(
+                    f"Issue #{issue_number} をプロジェクトに追加しました。"
+                )
+            else:  # item_id が取得できなかった場合 (プロジェクト追加のミューテーションが失敗した場合など)
+                error_msg = f"Issue #{issue_number} のプロジェクト追加に失敗しました。"
+                errors.append(error_msg)
+                progress_lines.append(error_msg)
+        elif project_id and not issue_node_id:  # Issue Node ID がない場合
+            error_msg = (
+                f"Issue #{issue_number} のNode IDが取得できず、"
+                "プロジェクトに追加できませんでした。"
+            )
+            errors.append(error_msg)
+            progress_lines.append(error_msg)
+        # else: project_id がない場合は、そもそもプロジェクト追加を行わない
+
+    progress.content = "GitHubへのIssue発行とプロジェクト追加が完了しました。\n" + "\n".join(
+        progress_lines
+    )
+    await progress.update()
 
     final_error_message = "\n".join(errors) if errors else None
 
@@ -325,9 +586,11 @@ async def github_publish_step(
 
 async def planning_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒント修正
     """企画ブラッシュアップステップ"""
-    print("--- Planning Step ---")
+    logger.info("--- Planning Step ---")
     # UI更新はメインスレッドで行うべきだが、ここでは一旦ノード内で実行
-    await cl.Message(content="企画ブラッシュアップアプリを実行中...").send()
+    # 応答は受信しながら同じメッセージに表示し、完了後に整形した内容で置き換える
+    msg = cl.Message(content="企画ブラッシュアップアプリを実行中...\n")
+    await msg.send()
     current_history = state.get("plan_conversation_history", [])
     if not current_history:  # 最初のクエリ
         query = state["initial_query"]
@@ -337,19 +600,17 @@ async def planning_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型
         query = current_history[-1].content
 
     # Dify API呼び出し
-    # conversation_idは履歴の最後のAIメッセージから取得、なければ新規
-    last_ai_message = next(
-        (msg for msg in reversed(current_history) if isinstance(msg, AIMessage)), None
-    )
-    conversation_id = (
-        last_ai_message.additional_kwargs.get("conversation_id", "")
-        if last_ai_message
-        else ""
-    )
+    # conversation_idは状態に保持しているものを使用、なければ新規
+    conversation_id = state.get("plan_conversation_id", "")
 
+    batcher = TokenBatcher(msg)
     response = await call_dify_api(
-        PLANNING_APP_API_KEY, query, conversation_id=conversation_id
+        PLANNING_APP_API_KEY,
+        query,
+        conversation_id=conversation_id,
+        on_answer=batcher.push,
     )
+    await batcher.flush()
 
     if response.get("error"):  # errorキーが存在するか確認
         return {"error_message": response["error"], "next_step": "error"}
@@ -359,44 +620,43 @@ async def planning_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型
         "conversation_id", conversation_id
     )  # IDがない場合は維持
 
-    # 応答を履歴に追加
-    ai_message = AIMessage(
-        content=ai_response_text,
-        additional_kwargs={"conversation_id": new_conversation_id},
-    )
-    updated_history = current_history + [ai_message]  # 新しいリストを作成
+    # 応答を履歴に追加 (reducerが既存の履歴に連結するため、追加分のみ返す)
+    ai_message = AIMessage(content=ai_response_text)
 
     # 応答の接頭辞を確認
-    if ai_response_text.startswith("終了"):
-        plan_output = ai_response_text[len("終了") :].strip()
-        print(f"Planning finished. Output:\n{plan_output}")
-        await cl.Message(
-            content=f"企画書が完成しました。\n```\n{plan_output}\n```"
-        ).send()
+    kind, body = _split_response_prefix(ai_response_text)
+    if kind is _END_PREFIX:
+        plan_output = body
+        logger.debug("Planning finished. Output:\n%s", plan_output)
+        msg.content = f"企画書が完成しました。\n```\n{plan_output}\n```"
+        await msg.update()
         # 戻り値は更新するフィールドのみ
         return {
-            "plan_conversation_history": updated_history,
+            "plan_conversation_history": [ai_message],
+            "plan_conversation_id": new_conversation_id,
             "plan_output": plan_output,
             "current_step": "planning",
             "next_step": "spec",
         }
-    elif ai_response_text.startswith("質問"):
-        question = ai_response_text[len("質問") :].strip()
-        print(f"Planning asking question: {question}")
-        await cl.Message(content=f"企画担当からの質問:\n{question}").send()
+    elif kind is _ASK_PREFIX:
+        question = body
+        logger.debug("Planning asking question: %s", question)
+        msg.content = f"企画担当からの質問:\n{question}"
+        await msg.update()
         return {
-            "plan_conversation_history": updated_history,
+            "plan_conversation_history": [ai_message],
+            "plan_conversation_id": new_conversation_id,
             "current_step": "planning",
             "next_step": "ask_user",
         }
     else:
-        print(f"Unexpected response from planning app: {ai_response_text}")
-        await cl.Message(
-            content=f"企画アプリから予期しない応答がありました:\n{ai_response_text}\n処理を継続します。"
-        ).send()
+        logger.warning("Unexpected response from planning app: %s", ai_response_text)
+        msg.content = f"企画アプリから予期しない応答がありました:\n{ai_response_text}\n処理を継続します。"
+        await msg.update()
         # 想定外でも企画書として扱う
         return {
-            "plan_conversation_history": updated_history,
+            "plan_conversation_history": [ai_message],
+            "plan_conversation_id": new_conversation_id,
             "plan_output": ai_response_text,  # そのまま出力
             "current_step": "planning",
             "next_step": "spec",  # 次のステップへ
@@ -405,8 +665,10 @@ async def planning_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型
 
 async def spec_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒント修正
     """技術仕様書作成ステップ"""
-    print("--- Spec Step ---")
-    await cl.Message(content="技術仕様書作成アプリを実行中...").send()
+    logger.info("--- Spec Step ---")
+    # 応答は受信しながら同じメッセージに表示し、完了後に整形した内容で置き換える
+    msg = cl.Message(content="技術仕様書作成アプリを実行中...\n")
+    await msg.send()
     current_history = state.get("spec_conversation_history", [])
     plan_output = state.get("plan_output", "")
 
@@ -414,25 +676,24 @@ async def spec_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒン
         return {"error_message": "企画書が見つかりません。", "next_step": "error"}
 
     if not current_history:  # 最初の呼び出し (企画書を入力とする)
-        query = f"以下の企画書に基づいて技術仕様を作成してください:\n\n{plan_output}"
+        query = _SPEC_BOOTSTRAP_QUERY.format(plan=plan_output)
         # 内部的な初期メッセージは履歴に加えない
-        # current_history.append(HumanMessage(content=query))
+        # 最初の呼び出しは常に新しい会話となる
+        conversation_id = ""
     else:  # ユーザーからの返信
         query = current_history[-1].content
+        conversation_id = state.get("spec_conversation_id", "")
 
     # Dify API呼び出し
-    last_ai_message = next(
-        (msg for msg in reversed(current_history) if isinstance(msg, AIMessage)), None
-    )
-    conversation_id = (
-        last_ai_message.additional_kwargs.get("conversation_id", "")
-        if last_ai_message
-        else ""
-    )
 
+    batcher = TokenBatcher(msg)
     response = await call_dify_api(
-        SPEC_APP_API_KEY, query, conversation_id=conversation_id
+        SPEC_APP_API_KEY,
+        query,
+        conversation_id=conversation_id,
+        on_answer=batcher.push,
     )
+    await batcher.flush()
 
     if response.get("error"):
         return {"error_message": response["error"], "next_step": "error"}
@@ -440,43 +701,42 @@ async def spec_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒン
     ai_response_text = response.get("answer", "")
     new_conversation_id = response.get("conversation_id", conversation_id)
 
-    # 応答を履歴に追加
-    ai_message = AIMessage(
-        content=ai_response_text,
-        additional_kwargs={"conversation_id": new_conversation_id},
-    )
-    updated_history = current_history + [ai_message]
+    # 応答を履歴に追加 (reducerが既存の履歴に連結するため、追加分のみ返す)
+    ai_message = AIMessage(content=ai_response_text)
 
     # 応答の接頭辞を確認
-    if ai_response_text.startswith("終了"):
-        spec_output = ai_response_text[len("終了") :].strip()
-        print(f"Spec finished. Output:\n{spec_output}")
-        await cl.Message(
-            content=f"技術仕様書が完成しました。\n```\n{spec_output}\n```"
-        ).send()
+    kind, body = _split_response_prefix(ai_response_text)
+    if kind is _END_PREFIX:
+        spec_output = body
+        logger.debug("Spec finished. Output:\n%s", spec_output)
+        msg.content = f"技術仕様書が完成しました。\n```\n{spec_output}\n```"
+        await msg.update()
         return {
-            "spec_conversation_history": updated_history,
+            "spec_conversation_history": [ai_message],
+            "spec_conversation_id": new_conversation_id,
             "spec_output": spec_output,
             "current_step": "spec",
             "next_step": "task",
         }
-    elif ai_response_text.startswith("質問"):
-        question = ai_response_text[len("質問") :].strip()
-        print(f"Spec asking question: {question}")
-        await cl.Message(content=f"技術仕様担当からの質問:\n{question}").send()
+    elif kind is _ASK_PREFIX:
+        question = body
+        logger.debug("Spec asking question: %s", question)
+        msg.content = f"技術仕様担当からの質問:\n{question}"
+        await msg.update()
         return {
-            "spec_conversation_history": updated_history,
+            "spec_conversation_history": [ai_message],
+            "spec_conversation_id": new_conversation_id,
             "current_step": "spec",
             "next_step": "ask_user",
         }
     else:
-        print(f"Unexpected response from spec app: {ai_response_text}")
-        await cl.Message(
-            content=f"技術仕様アプリから予期しない応答がありました:\n{ai_response_text}\n処理を継続します。"
-        ).send()
+        logger.warning("Unexpected response from spec app: %s", ai_response_text)
+        msg.content = f"技術仕様アプリから予期しない応答がありました:\n{ai_response_text}\n処理を継続します。"
+        await msg.update()
         # 想定外でも仕様書として扱う
         return {
-            "spec_conversation_history": updated_history,
+            "spec_conversation_history": [ai_message],
+            "spec_conversation_id": new_conversation_id,
             "spec_output": ai_response_text,  # そのまま出力
             "current_step": "spec",
             "next_step": "task",  # 次のステップへ
@@ -485,8 +745,10 @@ async def spec_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒン
 
 async def task_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒント修正
     """タスク分解ステップ"""
-    print("--- Task Step ---")
-    await cl.Message(content="タスク分解アプリを実行中...").send()
+    logger.info("--- Task Step ---")
+    # タスク分解の出力は受信しながら同じメッセージに表示する
+    msg = cl.Message(content="タスク分解アプリを実行中...\n")
+    await msg.send()
     plan_output = state.get("plan_output", "")
     spec_output = state.get("spec_output", "")
 
@@ -502,19 +764,51 @@ async def task_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒン
     # 必要であれば固定の指示を inputs に追加
     # inputs["instruction"] = "企画書と技術仕様書からタスクを分解してください。"
 
-    response = await call_completion_api(TASK_APP_API_KEY, inputs=inputs)
+    batcher = TokenBatcher(msg)
+    response = await call_completion_api(
+        TASK_APP_API_KEY, inputs=inputs, on_answer=batcher.push
+    )
+    await batcher.flush()
 
     if response.get("error"):
         return {"error_message": response["error"], "next_step": "error"}
 
     task_output_str = response.get("answer", "")  # answerがない場合も考慮
-    print(f"Task decomposition finished. Output:\n{task_output_str}")
-    await cl.Message(
-        content=f"タスク分解が完了しました。\n```\n{task_output_str}\n```"
-    ).send()
+    logger.debug("Task decomposition finished. Output:\n%s", task_output_str)
+    msg.content = f"タスク分解が完了しました。\n```\n{task_output_str}\n```"
+    await msg.update()
+
+    # タスクリストはここで一度だけ解析し、解析済みのリストを状態に持たせる
+    try:
+        task_list_data = orjson.loads(task_output_str)
+    except orjson.JSONDecodeError:
+        logger.error("Failed to decode task_output JSON: %s", task_output_str)
+        return {
+            "error_message": "タスク分解アプリの出力(JSON)の解析に失敗しました。",
+            "next_step": "error",
+        }
+    tasks = task_list_data.get("issues") if isinstance(task_list_data, dict) else None
+    # "issues" キーが存在し、それがリストであることを確認
+    if not isinstance(tasks, list):
+        # 想定外の形式の場合、task_output全体を単一タスクとして扱うか、エラーにする
+        # ここではエラーとする
+        logger.error("Unexpected format in task_output: %s", task_output_str)
+        return {
+            "error_message": "タスク分解アプリの出力形式が不正です。",
+            "next_step": "error",
+        }
+
+    # task_title が文字列であることを念のため確認
+    task_list: List[str] = []
+    for task_title in tasks:
+        if not isinstance(task_title, str):
+            logger.warning("Skipping non-string task item: %r", task_title)
+            continue
+        task_list.append(task_title)
 
     return {
         "task_output": task_output_str,
+        "task_list": task_list,
         "current_step": "task",
         "next_step": "issue",
     }
@@ -522,7 +816,7 @@ async def task_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒン
 
 async def issue_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒント修正
     """Issue出力ステップ"""
-    print("--- Issue Step ---")
+    logger.info("--- Issue Step ---")
     await cl.Message(content="Issue出力アプリを実行中...").send()
     plan_output = state.get("plan_output", "")
     spec_output = state.get("spec_output", "")
@@ -531,50 +825,44 @@ async def issue_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒ
     if not task_output:
         return {"error_message": "タスクリストが見つかりません。", "next_step": "error"}
 
-    # Dify Completion API呼び出しのための準備 (inputsはループ内で生成)
+    # タスクリストは task_step で解析・検証済み
+    task_titles: List[str] = state.get("task_list", [])
 
-    try:
-        task_list_data = json.loads(task_output)
-        # "issues" キーが存在し、それがリストであることを確認
-        if (
-            isinstance(task_list_data, dict)
-            and "issues" in task_list_data
-            and isinstance(task_list_data["issues"], list)
-        ):
-            tasks = task_list_data["issues"]
-        else:
-            # 想定外の形式の場合、task_output全体を単一タスクとして扱うか、エラーにする
-            # ここではエラーとする
-            print(f"Error: Unexpected format in task_output: {task_output}")
-            return {
-                "error_message": "タスク分解アプリの出力形式が不正です。",
-                "next_step": "error",
-            }
-    except json.JSONDecodeError:
-        print(f"Error: Failed to decode task_output JSON: {task_output}")
-        return {
-            "error_message": "タスク分解アプリの出力(JSON)の解析に失敗しました。",
-            "next_step": "error",
+    # 全タスク共通のinputsは一度だけシリアライズし、タスクごとにtitleだけを連結する
+    # (末尾の "}" を除いたバイト列を共有する)
+    shared_inputs = orjson.dumps(
+        {
+            "plan": plan_output,
+            "tech_spec": spec_output,
+            "tasks": task_output,  # 元のタスクリスト全体もコンテキストとして渡す
         }
+    )[:-1]
+
+    # Issue本文生成のためのAPI呼び出しを同時実行数を制限して並列に行う
+    # (タスクごとに参照する値はローカル変数に束縛しておく)
+    semaphore = asyncio.Semaphore(ISSUE_GENERATION_CONCURRENCY)
+    call_api = call_completion_api
+    api_key = ISSUE_APP_API_KEY
+
+    async def generate_issue_body(task_title: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await call_api(
+                api_key,
+                # 現在処理中のタスクタイトル
+                inputs=orjson.Fragment(
+                    shared_inputs + b',"title":' + orjson.dumps(task_title) + b"}"
+                ),
+            )
 
-    issues: List[Dict[str, str]] = []  # Issue情報を格納するリスト (辞書形式)
-    for task_title in tasks:
-        # task_title が文字列であることを念のため確認
-        if not isinstance(task_title, str):
-            print(f"Warning: Skipping non-string task item: {task_title}")
-            continue
-
-        # Issue本文生成のためのAPI呼び出し
-        response = await call_completion_api(
-            ISSUE_APP_API_KEY,
-            inputs={  # inputs を毎回生成
-                "plan": plan_output,
-                "tech_spec": spec_output,
-                "tasks": task_output,  # 元のタスクリスト全体もコンテキストとして渡す
-                "title": task_title,  # 現在処理中のタスクタイトル
-            },
-        )
+    responses = await asyncio.gather(
+        *(generate_issue_body(task_title) for task_title in task_titles),
+        return_exceptions=True,
+    )
 
+    issues: List[Dict[str, str]] = []  # Issue情報を格納するリスト (辞書形式)
+    for task_title, response in zip(task_titles, responses):
+        if isinstance(response, Exception):
+            response = {"answer": "", "error": str(response)}
         if response.get("error"):
             # 1つのIssue生成エラーで全体をエラーとする
             return {
@@ -584,9 +872,9 @@ async def issue_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒ
 
         issue_body = response.get("answer", "")  # answerがない場合も考慮
         issues.append({"title": task_title, "body": issue_body})
-        print(f"Issue generated for '{task_title}'. Body:\n{issue_body[:100]}...")
+        logger.debug("Issue generated for '%s'. Body:\n%.100s...", task_title, issue_body)
 
-    print(f"Generated {len(issues)} issues.")
+    logger.info("Generated %d issues.", len(issues))
 
     # 完了メッセージは run_graph 関数で表示 (GitHub発行後)
 
@@ -598,37 +886,37 @@ async def issue_step(state: AppState) -> Dict[str, Any]:  # 戻り値の型ヒ
 
 
 # --- 条件分岐ロジック ---
+# next_step の値から遷移先ノードへの対応表
+_NEXT_MAP: Dict[str, str] = {
+    "ask_user": "ask_user",
+    "spec": "spec",  # 仕様ステップへ
+    "task": "task",  # タスク分解ステップへ
+    "issue": "issue",  # Issue出力ステップへ
+    "github_publish": "github_publish",  # GitHub発行ステップへ
+    "end": END,  # 終了
+}
+
+
 def should_continue_or_ask(state: Dict[str, Any]) -> str:  # stateの型ヒントをDictに
     """企画/仕様ステップ後、継続するかユーザーに質問するかを判断"""
-    next_step = state.get("next_step", "")  # next_stepがない場合も考慮
     error_message = state.get("error_message")
-
     if error_message:
-        print(f"Decision: Error ({error_message})")
-        return "error"
-    elif next_step == "ask_user":
-        print("Decision: Ask User")
-        return "ask_user"
-    elif next_step == "spec":
-        print("Decision: Continue to Spec")
-        return "spec"  # 仕様ステップへ
-    elif next_step == "task":
-        print("Decision: Continue to Task")
-        return "task"  # タスク分解ステップへ
-    elif next_step == "issue":
-        print("Decision: Continue to Issue")
-        return "issue"  # Issue出力ステップへ
-    elif next_step == "github_publish":
-        print("Decision: Continue to GitHub Publish")
-        return "github_publish"  # GitHub発行ステップへ
-    elif next_step == "end":
-        print("Decision: End")
-        return END  # 終了
-    else:
-        print(f"Decision: Error (Unknown next step: '{next_step}')")
-        # 不明な場合はエラーとする
+        logger.debug("Decision: Error (%s)", error_message)
         return "error"
 
+    next_step = state.get("next_step", "")  # next_stepがない場合も考慮
+    # 不明な場合はエラーとする
+    decision = _NEXT_MAP.get(next_step, "error")
+    logger.debug("Decision: %s (next_step: '%s')", decision, next_step)
+    return decision
+
+
+def error_step(state: AppState) -> Dict[str, Any]:
+    """エラーをコンソールに出力し、エラー状態であることを記録する"""
+    error_message = state.get("error_message") or "Unknown error from error_node"
+    logger.error("Error Node Triggered: %s", error_message)
+    return {"error_message": error_message, "current_step": "error"}
+
 
 # --- LangGraphグラフ構築 ---
 # AppStateではなくDict[str, Any]を使用する方がLangGraphの挙動と整合性が取れる場合がある
@@ -641,13 +929,10 @@ workflow.add_node("spec", spec_step)
 workflow.add_node("task", task_step)
 workflow.add_node("issue", issue_step)
 workflow.add_node("github_publish", github_publish_step)  # GitHub発行ノード追加
-# error_node はエラーメッセージをコンソールに出力し、状態をそのまま返す
-workflow.add_node(
-    "error_node",
-    lambda state: print(
-        f"Error Node Triggered: {state.get('error_message', 'Unknown error')}"
-    ),
-)
+workflow.add_node("error_node", error_step)
+
+# ask_user ノードの直前でグラフを中断し、ユーザーの返答をこのノードの出力として記録して再開する
+workflow.add_node("ask_user", lambda state: {})
 
 # エントリーポイントを設定
 workflow.set_entry_point("planning")
@@ -659,7 +944,7 @@ workflow.add_conditional_edges(
     should_continue_or_ask,
     {
         "spec": "spec",
-        "ask_user": END,  # ユーザー入力待ちのためグラフを一旦終了
+        "ask_user": "ask_user",  # ユーザー入力待ちのためグラフを中断
         "error": "error_node",
     },
 )
@@ -669,7 +954,7 @@ workflow.add_conditional_edges(
     should_continue_or_ask,
     {
         "task": "task",
-        "ask_user": END,  # ユーザー入力待ちのためグラフを一旦終了
+        "ask_user": "ask_user",  # ユーザー入力待ちのためグラフを中断
         "error": "error_node",
     },
 )
@@ -691,11 +976,79 @@ workflow.add_conditional_edges(
     should_continue_or_ask,  # next_stepを見て判断 (end or error)
     {END: END, "error": "error_node"},
 )
+# ユーザーの返答後は質問したステップへ戻る
+workflow.add_conditional_edges(
+    "ask_user",
+    lambda state: state.get("current_step", ""),
+    {"planning": "planning", "spec": "spec"},
+)
 # エラーノードからは終了
 workflow.add_edge("error_node", END)
 
+# グラフの状態はチェックポインタが thread_id (企画ごとに発行) 単位で保持する
+_CHECKPOINTER = MemorySaver()
+
+# グラフ構造はセッションによらず不変のため、import時に一度だけコンパイルする
+_COMPILE_ERROR: Optional[Exception] = None
+try:
+    COMPILED_WORKFLOW = workflow.compile(
+        checkpointer=_CHECKPOINTER,
+        interrupt_before=["ask_user"],
+    )
+except Exception as e:
+    COMPILED_WORKFLOW = None
+    _COMPILE_ERROR = e
+    logger.error("Error compiling graph: %s", e)
+
 
 # --- Chainlit UI ---
+# セッション開始・リセット時の状態 (リスト以外のフィールド)
+_EMPTY_APP_STATE_TEMPLATE: Dict[str, Any] = {
+    "initial_query": "",
+    "plan_output": "",
+    "plan_conversation_id": "",
+    "spec_output": "",
+    "spec_conversation_id": "",
+    "task_output": "",
+    "current_step": "start",
+    "next_step": "",
+    "error_message": None,
+}
+# セッション間で共有しないよう、毎回新しいリストを割り当てるフィールド
+_EMPTY_LIST_FIELDS = (
+    "plan_conversation_history",
+    "spec_conversation_history",
+    "task_list",
+    "issue_output",
+    "created_issues",
+)
+
+
+def _empty_app_state() -> Dict[str, Any]:
+    """初期状態の app_state を作成する (プロジェクトIDはセッションから引き継ぐ)"""
+    state = dict(_EMPTY_APP_STATE_TEMPLATE)
+    for field in _EMPTY_LIST_FIELDS:
+        state[field] = []
+    state["github_project_id"] = cl.user_session.get("github_project_id")
+    return state
+
+
+@cl.on_app_shutdown
+async def close_http_client():
+    """アプリ終了時に共有HTTPクライアントを閉じ、ログのリスナーを停止する"""
+    await _DIFY_CLIENT.aclose()
+    _LOG_LISTENER.stop()
+
+
+@cl.on_chat_end
+async def end_chat():
+    """セッション終了時にチェックポイントとGitHubクライアントの接続を破棄する"""
+    await _discard_thread()
+    github_client: Optional[GitHubClient] = cl.user_session.get("github_client")
+    if github_client is not None:
+        await github_client.aclose()
+
+
 @cl.on_chat_start
 async def start_chat():
     # --- GitHub Client Initialization ---
@@ -716,64 +1069,49 @@ async def start_chat():
                 token=GITHUB_PAT, owner=GITHUB_OWNER, repo=GITHUB_REPO
             )
             cl.user_session.set("github_client", github_client)
-            print("GitHub client initialized successfully.")
-            # 初期状態でプロジェクトIDを取得しておく
-            if GITHUB_PROJECT_NUMBER is not None:
-                print(
-                    f"Attempting to pre-fetch Project ID for project number {GITHUB_PROJECT_NUMBER}"
-                )
-                project_id = await github_client.get_project_v2_id(
-                    GITHUB_PROJECT_NUMBER
-                )
-                if project_id:
-                    cl.user_session.set("github_project_id", project_id)
-                    print(f"Pre-fetched Project ID: {project_id}")
-                else:
-                    # IDが見つからない場合もエラーとはしない（publishステップで再試行）
-                    print(
-                        f"Could not pre-fetch Project ID for project number {GITHUB_PROJECT_NUMBER}."
-                    )
+            logger.info("GitHub client initialized successfully.")
         except ValueError as e:  # 初期化時の必須引数チェックエラー
             github_error = f"GitHubクライアント初期化エラー: {e}"
-            print(github_error)
-        except Exception as e:  # APIアクセス中の予期せぬエラー
-            github_error = (
-                f"GitHubクライアント初期化・プロジェクトID取得中に予期せぬエラー: {e}"
-            )
-            print(github_error)
+            logger.error(github_error)
     else:
         github_error = (
             f"GitHub連携に必要な環境変数が不足しています: {', '.join(missing_vars)}"
         )
-        print(github_error)
-
-    # --- Graph Compilation ---
-    if cl.user_session.get("graph_runner") is None:
+        logger.warning(github_error)
+
+    # --- Project ID Pre-fetch ---
+    # 初期状態でプロジェクトIDを取得しておく
+    if github_client is not None and GITHUB_PROJECT_NUMBER is not None:
+        logger.info(
+            "Attempting to pre-fetch Project ID for project number %s",
+            GITHUB_PROJECT_NUMBER,
+        )
         try:
-            app = workflow.compile()
-            cl.user_session.set("graph_runner", app)
-            print("Graph compiled successfully.")
-        except Exception as e:
-            print(f"Error compiling graph: {e}")
-            await cl.Message(content=f"グラフのコンパイルエラー: {e}").send()
-            return
+            project_id = await github_client.get_project_v2_id(GITHUB_PROJECT_NUMBER)
+            if project_id:
+                cl.user_session.set("github_project_id", project_id)
+                logger.info("Pre-fetched Project ID: %s", project_id)
+            else:
+                # IDが見つからない場合もエラーとはしない（publishステップで再試行）
+                logger.info(
+                    "Could not pre-fetch Project ID for project number %s.",
+                    GITHUB_PROJECT_NUMBER,
+                )
+        except Exception as e:  # APIアクセス中の予期せぬエラー
+            github_error = (
+                f"GitHubクライアント初期化・プロジェクトID取得中に予期せぬエラー: {e}"
+            )
+            logger.error(github_error)
+
+    # --- Graph Runner ---
+    if COMPILED_WORKFLOW is None:
+        await cl.Message(content=f"グラフのコンパイルエラー: {_COMPILE_ERROR}").send()
+        return
+    cl.user_session.set("graph_runner", COMPILED_WORKFLOW)
 
     # --- Initial State Setup ---
-    # AppStateではなくDictとして初期化する方が安全かもしれない
-    initial_state: Dict[str, Any] = {
-        "initial_query": "",
-        "plan_conversation_history": [],
-        "plan_output": "",
-        "spec_conversation_history": [],
-        "spec_output": "",
-        "task_output": "",
-        "issue_output": [],
-        "github_project_id": cl.user_session.get("github_project_id"),
-        "created_issues": [],
-        "current_step": "start",
-        "next_step": "",
-        "error_message": github_error,
-    }
+    initial_state = _empty_app_state()
+    initial_state["error_message"] = github_error
     cl.user_session.set("app_state", initial_state)
 
     # --- Initial Message ---
@@ -803,21 +1141,17 @@ async def main(message: cl.Message):
         # 状態をコピーして更新するのではなく、必要な情報だけを渡してグラフを再開
         resume_state: Dict[str, Any] = {}
         if current_step_logic == "planning":
-            print("User responded to planning question.")
-            # 既存の履歴にユーザーメッセージを追加
-            history = app_state.get("plan_conversation_history", [])
+            logger.info("User responded to planning question.")
+            # ユーザーメッセージを履歴に追加 (既存の履歴はチェックポインタが保持)
             resume_state = {
-                "plan_conversation_history": history
-                + [HumanMessage(content=message.content)]
+                "plan_conversation_history": [HumanMessage(content=message.content)]
             }
             # 再開ポイントは planning ノード
             await run_graph(resume_state, resume_from="planning")
         elif current_step_logic == "spec":
-            print("User responded to spec question.")
-            history = app_state.get("spec_conversation_history", [])
+            logger.info("User responded to spec question.")
             resume_state = {
-                "spec_conversation_history": history
-                + [HumanMessage(content=message.content)]
+                "spec_conversation_history": [HumanMessage(content=message.content)]
             }
             # 再開ポイントは spec ノード
             await run_graph(resume_state, resume_from="spec")
@@ -827,16 +1161,21 @@ async def main(message: cl.Message):
 
     # 最初の入力 ("start" 状態)
     elif current_step_logic == "start":
-        print("Starting graph execution.")
-        # start_chatで設定された初期状態をベースに、最初のクエリを追加
-        initial_state_from_session = cl.user_session.get("app_state", {})
-        start_state: Dict[str, Any] = {
-            **initial_state_from_session,  # セッションの状態を引き継ぐ
-            "initial_query": message.content,
-            "plan_conversation_history": [HumanMessage(content=message.content)],
-            # 他のフィールドは initial_state_from_session から引き継がれる
-        }
-        await run_graph(start_state)  # 最初から実行
+        logger.info("Starting graph execution.")
+        # 企画ごとに新しいスレッドでチェックポイントを取る
+        # (実行設定はこの企画の間、同じオブジェクトを使い回す)
+        cl.user_session.set(
+            "graph_config",
+            {
+                "configurable": {"thread_id": uuid.uuid4().hex},
+                "recursion_limit": 50,
+            },
+        )
+        # start_chatで設定された初期状態に、最初のクエリだけを書き込む
+        # (セッションの状態はこの企画専用の辞書のため、コピーせずに更新する)
+        app_state["initial_query"] = message.content
+        app_state["plan_conversation_history"] = [HumanMessage(content=message.content)]
+        await run_graph(app_state)  # 最初から実行
     # グラフ実行中の場合
     elif current_step_logic != "start" and next_step_flag != "ask_user":
         await cl.Message(
@@ -845,10 +1184,84 @@ async def main(message: cl.Message):
     # 上記以外 (ask_userでもstartでもなく、実行中でもない) は基本的に到達しないはずだが、
     # 到達した場合に備えてメッセージを出すか、何もしないか。ここでは何もしない。
     # else:
-    #     print(f"Unexpected state in main: current_step={current_step_logic}, next_step={next_step_flag}")
+    #     logger.warning("Unexpected state in main: current_step=%s, next_step=%s", current_step_logic, next_step_flag)
     #     await cl.Message(content="予期しない状態です。").send()
 
 
+# --- 終了時の処理 ---
+async def _handle_error(final_state: Dict[str, Any]) -> None:
+    """エラーで終了した場合 (error_node 到達時を含む)"""
+    # エラー発生後もリセットしてよいか、要検討。一旦リセットする。
+    await reset_chat_state(f"エラーが発生しました: {final_state.get('error_message')}")
+
+
+async def _handle_pause(final_state: Dict[str, Any]) -> None:
+    """ユーザー入力待ちなので完了メッセージは表示しない"""
+
+
+async def _handle_publish_success(final_state: Dict[str, Any]) -> None:
+    """GitHub発行ステップが正常終了した場合"""
+    created_issues_info = final_state.get("created_issues") or ()
+    if created_issues_info:
+        # Issueごとに number/html_url を一度だけ取り出す
+        issue_links = "\n".join(
+            f"- [Issue #{number}]({url})"
+            for number, url in (
+                (i.get("number"), i.get("html_url")) for i in created_issues_info
+            )
+            if number and url
+        )
+        project_note = (
+            f"\nIssueはプロジェクト #{GITHUB_PROJECT_NUMBER} に追加されました（一部失敗している可能性あり）。"
+            if cl.user_session.get("github_project_id")
+            and GITHUB_PROJECT_NUMBER is not None
+            else ""
+        )
+        result_message = f"処理完了。以下のIssueがGitHubに作成されました:\n{issue_links}{project_note}"
+    else:
+        result_message = "処理完了。Issueは作成されませんでした。"
+
+    # 完了報告と次の入力の案内は1つのメッセージで送る
+    await reset_chat_state(result_message)  # 正常完了後リセット
+
+
+async def _handle_finished(final_state: Dict[str, Any]) -> None:
+    """github_publish を経由せずに正常終了した場合"""
+    await reset_chat_state("処理は正常に完了しました。")
+
+
+async def _handle_unexpected(final_state: Dict[str, Any]) -> None:
+    """エラーでもask_userでもなく、正常完了でもない場合"""
+    await reset_chat_state("処理は完了しましたが、予期しない状態です。")
+
+
+# (最後に実行したステップ, next_step, エラーの有無) から終了時の処理への対応表
+# "*" は任意の値に一致する
+_TERMINAL_HANDLERS: Dict[
+    Tuple[str, str, bool], Callable[[Dict[str, Any]], Awaitable[None]]
+] = {
+    ("*", "*", True): _handle_error,
+    ("*", "ask_user", False): _handle_pause,
+    ("github_publish", "end", False): _handle_publish_success,
+    ("*", "end", False): _handle_finished,
+}
+
+
+def _match_terminal_handler(
+    current_step: str, next_step: Optional[str], has_error: bool
+) -> Callable[[Dict[str, Any]], Awaitable[None]]:
+    """終了時の状態に対応する処理を、具体的なキーから順に探す"""
+    for key in (
+        (current_step, next_step, has_error),
+        ("*", next_step, has_error),
+        ("*", "*", has_error),
+    ):
+        handler = _TERMINAL_HANDLERS.get(key)
+        if handler is not None:
+            return handler
+    return _handle_unexpected
+
+
 # --- グラフ実行関数 ---
 async def run_graph(input_state: Dict[str, Any], resume_from: Optional[str] = None):
     """LangGraphを実行し、状態を更新する"""
@@ -859,77 +1272,49 @@ async def run_graph(input_state: Dict[str, Any], resume_from: Optional[str] = No
         ).send()
         return
 
-    # 現在のセッション状態を取得し、入力状態で更新
-    current_session_state = cl.user_session.get("app_state", {})
-    merged_state = {**current_session_state, **input_state}
+    config: RunnableConfig = cl.user_session.get("graph_config")
 
-    # 再開ポイントが指定されている場合は、そのノードから実行を開始
-    # LangGraphのastreamは再開ポイントを直接指定できないため、
-    # 実行するノードを制御するロジックが必要になる場合がある。
-    # ここでは、input_stateに必要な情報が含まれていると仮定し、
-    # グラフ全体を再実行するが、条件分岐で適切なパスに進むことを期待する。
-    # (より高度な制御が必要な場合は、Graph.streamのcheckpointerなどを使う)
+    if resume_from:
+        # ユーザーの返答を ask_user ノードの出力として記録し、中断した箇所から再開する
+        # (完了済みのノードは再実行されない)
+        await app.aupdate_state(config, input_state, as_node="ask_user")
+        stream_input = None
+        merged_state = cl.user_session.get("app_state", {})
+    else:
+        stream_input = input_state
+        merged_state = input_state
+    # 実行中はこの辞書をその場で更新するため、セッションへの保存は一度だけでよい
+    cl.user_session.set("app_state", merged_state)
 
-    final_state = None
+    final_state: Optional[Dict[str, Any]] = None
     current_step_name = merged_state.get(
         "current_step", "planning"
     )  # デフォルトはplanning
 
     try:
-        async for event in app.astream(merged_state, {"recursion_limit": 50}):
-            keys = event.keys()
-            # print(f"Graph Event Keys: {keys}") # デバッグ用
-
-            # イベントから最新の状態を取得
-            # イベントのキーは実行されたノード名
-            if END in keys:
-                final_state = event[END]
-                print("--- Graph Finished ---")
-                break
-            elif "error_node" in keys:
-                # エラーノードが呼ばれた場合、その時点の状態を最終状態とする
-                # error_node自体は状態を変更しない想定
-                final_state = merged_state  # エラー発生直前の状態
-                final_state["error_message"] = final_state.get(
-                    "error_message", "Unknown error from error_node"
-                )
-                current_step_name = "error"
-                print(
-                    f"--- Graph Finished with Error ({final_state['error_message']}) ---"
-                )
-                break
-            else:
-                # 通常のノード実行の場合、イベント辞書から状態を取得
-                # イベント辞書のキーは一つのはず (実行されたノード名)
-                if len(keys) == 1:
-                    node_name = list(keys)[0]
-                    current_step_name = node_name
-                    # イベントの値が更新された状態
-                    updated_fields = event[node_name]
+        async for event in app.astream(stream_input, config, stream_mode="updates"):
+            logger.debug("Graph event: %r", event)
+            # イベントは {ノード名: そのノードが返した更新} の形式
+            for node_name, updated_fields in event.items():
+                # 中断の通知 (__interrupt__) はノードの更新ではない
+                if node_name.startswith("__"):
+                    continue
+                current_step_name = node_name
+                if updated_fields:
                     # 現在のセッション状態にマージ
-                    merged_state = {**merged_state, **updated_fields}
-                    # print(f"State updated by node '{node_name}': {updated_fields}") # デバッグ用
-                else:
-                    # 予期しないイベント形式
-                    print(f"Warning: Unexpected graph event structure: {event}")
-                    # とりあえず最後の状態を使う
-                    final_state = merged_state
-                    break
-
-            # 更新された状態をセッションに保存
-            cl.user_session.set("app_state", merged_state)
-
-            # ユーザー入力待ちで中断する場合
-            if merged_state.get("next_step") == "ask_user":
-                print(f"--- Graph Paused for User Input ({current_step_name}) ---")
-                final_state = merged_state  # 中断時の状態を最終状態とする
-                break
+                    merged_state.update(updated_fields)
+
+        # 中断・終了時点の状態はチェックポイントから取得する
+        snapshot = await app.aget_state(config)
+        final_state = snapshot.values
+        current_step_name = final_state.get("current_step", current_step_name)
+        if snapshot.next:
+            logger.info("Graph paused for user input (%s)", current_step_name)
+        else:
+            logger.info("Graph finished (%s)", current_step_name)
 
     except Exception as e:
-        print(f"Error during graph execution: {e}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception("Graph execution failed")
         await cl.Message(content=f"グラフ実行中に予期せぬエラーが発生: {e}").send()
         # エラー発生時の状態を保存
         error_state = cl.user_session.get("app_state", {})
@@ -941,91 +1326,30 @@ async def run_graph(input_state: Dict[str, Any], resume_from: Optional[str] = No
         # 最終状態をセッションに保存
         cl.user_session.set("app_state", final_state)
 
-        error_msg = final_state.get("error_message")
-        next_step = final_state.get("next_step")
-
-        if error_msg and current_step_name != "error":
-            # error_node以外でエラーメッセージがある場合
-            await cl.Message(content=f"エラーが発生しました: {error_msg}").send()
-            # エラー発生後もリセットしてよいか、要検討。一旦リセットする。
-            await reset_chat_state()
-
-        elif next_step == "ask_user":
-            # ユーザー入力待ちなので完了メッセージは表示しない
-            pass
-
-        elif current_step_name == "github_publish" and not error_msg:
-            # GitHub発行ステップが正常終了した場合
-            created_issues_info = final_state.get("created_issues", [])
-            result_message = ""
-            if created_issues_info:
-                issue_links = [
-                    f"- [Issue #{i.get('number')}]({i.get('html_url')})"
-                    for i in created_issues_info
-                    if i.get("number") and i.get("html_url")
-                ]
-                result_message = (
-                    "処理完了。以下のIssueがGitHubに作成されました:\n"
-                    + "\n".join(issue_links)
-                )
-                if (
-                    cl.user_session.get("github_project_id")
-                    and GITHUB_PROJECT_NUMBER is not None
-                ):
-                    result_message += f"\nIssueはプロジェクト #{GITHUB_PROJECT_NUMBER} に追加されました（一部失敗している可能性あり）。"
-            else:
-                result_message = "処理完了。Issueは作成されませんでした。"
-
-            await cl.Message(content=result_message).send()
-            await reset_chat_state()  # 正常完了後リセット
-
-        elif current_step_name == "error":
-            # error_node に到達した場合 (エラーメッセージは上で表示済み)
-            await reset_chat_state()  # エラー後リセット
-
-        elif next_step == END and not error_msg:
-            # github_publish を経由せずに正常終了した場合 (例: Issueがなかった、またはGitHub連携なし)
-            # この条件は github_publish 成功時の後にも評価される可能性があるため、
-            # current_step_name で区別するか、より明確な完了フラグが必要かもしれない。
-            # ここでは github_publish 以外での正常終了とみなす。
-            if current_step_name != "github_publish":
-                await cl.Message(content="処理は正常に完了しました。").send()
-                await reset_chat_state()
-            # github_publish 成功時は既にメッセージ表示とリセット済みなので何もしない
-
-        # 上記以外のケース (エラーでもask_userでもなく、正常完了でもない)
-        elif current_step_name != "error" and next_step != "ask_user":
-            await cl.Message(
-                content="処理は完了しましたが、予期しない状態です。"
-            ).send()
-            await reset_chat_state()
-        # else: # error でも ask_user でもなく、next_step が END でもない場合 (通常は到達しない)
-        #     print(f"Unhandled final state: current_step={current_step_name}, next_step={next_step}, error={error_msg}")
-
-
-async def reset_chat_state():
-    """チャットの状態をリセットし、次の入力を促す"""
-    await cl.Message(content="新しい企画の素案を入力してください。").send()
-    # GitHubクライアントとプロジェクトIDは維持
-    github_project_id = cl.user_session.get("github_project_id")
-    # AppStateではなくDictとして初期化
-    cl.user_session.set(
-        "app_state",
-        {
-            "initial_query": "",
-            "plan_conversation_history": [],
-            "plan_output": "",
-            "spec_conversation_history": [],
-            "spec_output": "",
-            "task_output": "",
-            "issue_output": [],
-            "github_project_id": github_project_id,  # 維持
-            "created_issues": [],
-            "current_step": "start",
-            "next_step": "",
-            "error_message": None,  # エラーリセット
-        },  # 閉じ括弧を追加
-    )
+        handler = _match_terminal_handler(
+            current_step_name,
+            final_state.get("next_step"),
+            bool(final_state.get("error_message")),
+        )
+        await handler(final_state)
+
+
+async def _discard_thread():
+    """現在の企画のチェックポイントを破棄する"""
+    config: Optional[RunnableConfig] = cl.user_session.get("graph_config")
+    if config:
+        await _CHECKPOINTER.adelete_thread(config["configurable"]["thread_id"])
+        cl.user_session.set("graph_config", None)
 
 
-# グラフのコンパイルは on_chat_start で行う
+async def reset_chat_state(prefix: str = ""):
+    """チャットの状態をリセットし、次の入力を促す
+
+    prefix を指定すると、案内メッセージの前に付けて1つのメッセージとして送る。
+    """
+    await _discard_thread()
+    prompt = "新しい企画の素案を入力してください。"
+    await cl.Message(content=f"{prefix}\n\n{prompt}" if prefix else prompt).send()
+    # GitHubクライアントとプロジェクトIDは維持
+    cl.user_session.set("app_state", _empty_app_state())
+
@@ -1,5 +1,8 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Callable, Optional, Sequence, Union
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain.schema import (
     AIMessage,
@@ -8,13 +11,31 @@ from langchain.schema import (
     SystemMessage,
 )
 
+# 履歴がこの件数を超えたら古いメッセージを要約する
+SUMMARIZE_THRESHOLD = 20
+# 要約せずにそのまま送る直近のメッセージ数
+RECENT_TURNS = 6
+
+# 同一入力の応答を再生するキャッシュの上限件数
+STREAM_CACHE_SIZE = 64
+# 古い履歴の要約を保持する件数
+SUMMARY_CACHE_SIZE = 64
+
+_SUMMARY_PROMPT = (
+    "以下はユーザーとアシスタントのこれまでの会話です。"
+    "決定事項や重要な前提が失われないように、日本語で簡潔に要約してください。"
+)
+
 
 class Chatbot(ABC):
+    # 送信内容のハッシュ -> 応答チャンク (ボットのインスタンスをまたいで共有する)
+    _stream_cache: "OrderedDict[str, list[str]]" = OrderedDict()
+
     def __init__(self):
-        self._messages: list[BaseMessage] = []
-        self._messages.append(
-            SystemMessage(content=self._SYSTEM_MESSAGE_PROMPT),
-        )
+        # システムメッセージは不変なので一度だけ生成して使い回す
+        self._system_msg = SystemMessage(content=self._SYSTEM_MESSAGE_PROMPT)
+        # 要約済みの履歴 (履歴のハッシュ -> 要約)
+        self._summary_cache: "OrderedDict[str, str]" = OrderedDict()
 
     @property
     @abstractmethod
@@ -32,13 +53,69 @@ class Chatbot(ABC):
         """
         pass
 
-    async def stream(self, user_message: str, history: list = None, **kwargs):
+    @property
+    def _summarizer(self) -> BaseChatModel:
+        """
+        古い履歴の要約に使うモデル。安価なモデルを使う場合はオーバーライドする。
+        """
+        return self._model
+
+    async def _compress_history(self, history: list[BaseMessage]) -> list[BaseMessage]:
+        """
+        履歴が長い場合、直近のメッセージ以外を1つの要約メッセージにまとめます。
+
+        Args:
+            history: 過去の対話履歴。
+
+        Returns:
+            モデルに送る履歴。
+        """
+        if len(history) <= SUMMARIZE_THRESHOLD:
+            return history
+
+        old = history[:-RECENT_TURNS]
+        key = hashlib.sha1(
+            "\0".join(f"{msg.type}:{msg.content}" for msg in old).encode()
+        ).hexdigest()
+        summary = self._summary_cache.get(key)
+        if summary is not None:
+            self._summary_cache.move_to_end(key)
+        else:
+            transcript = "\n".join(f"{msg.type}: {msg.content}" for msg in old)
+            result = await self._summarizer.ainvoke(
+                [
+                    SystemMessage(content=_SUMMARY_PROMPT),
+                    HumanMessage(content=transcript),
+                ]
+            )
+            summary = result.content
+            self._summary_cache[key] = summary
+            if len(self._summary_cache) > SUMMARY_CACHE_SIZE:
+                self._summary_cache.popitem(last=False)
+        return [
+            AIMessage(content=f"これまでの会話の要約: {summary}"),
+            *history[-RECENT_TURNS:],
+        ]
+
+    async def stream(
+        self,
+        user_message: str,
+        history: Optional[Sequence[Union[BaseMessage, dict]]] = None,
+        on_response_id: Optional[Callable[[str], None]] = None,
+        deterministic: bool = False,
+        **kwargs,
+    ):
         """
         ユーザーメッセージと履歴を処理し、ストリーミングで応答を生成します。
 
         Args:
             user_message: ユーザーからの入力メッセージ。
             history: 過去の対話履歴のリスト (例: [{"user": "msg"}, {"ai": "msg"}])。
+                BaseMessage のリストを渡した場合は変換せずにそのまま使用する。
+            on_response_id: Responses API の応答IDを受け取るコールバック。
+                次回の呼び出しで previous_response_id として渡すと履歴の再送が不要になる。
+            deterministic: True の場合、temperature に関わらず同じ入力への応答をキャッシュし、
+                次回以降はモデルを呼び出さずに再生する (temperature=0 のモデルは常にキャッシュする)。
 
         Returns:
             生成された応答テキスト。
@@ -49,29 +126,54 @@ class Chatbot(ABC):
         # Add history messages if provided
         if history:
             for msg in history:
-                if "user" in msg:
+                if isinstance(msg, BaseMessage):
+                    current_messages.append(msg)
+                elif "user" in msg:
                     current_messages.append(HumanMessage(content=msg["user"]))
                 elif "ai" in msg:
                     current_messages.append(AIMessage(content=msg["ai"]))
+            current_messages = await self._compress_history(current_messages)
         # システムメッセージのルールは忘れられないようにできるだけ最後に
-        current_messages.append(SystemMessage(content=self._SYSTEM_MESSAGE_PROMPT))
+        # (previous_response_id で会話を続ける場合は初回に送った分がサーバー側に残っている)
+        if "previous_response_id" not in kwargs:
+            current_messages.append(self._system_msg)
         
         # Add the current user message
         current_messages.append(HumanMessage(content=user_message))
 
-        response_content = ""
+        use_cache = deterministic or getattr(self._model, "temperature", None) == 0
+        if use_cache:
+            key = hashlib.sha256(
+                "\0".join(
+                    [f"{msg.type}:{msg.content}" for msg in current_messages]
+                    + [f"{name}={value!r}" for name, value in sorted(kwargs.items())]
+                ).encode()
+            ).hexdigest()
+            cached = self._stream_cache.get(key)
+            if cached is not None:
+                self._stream_cache.move_to_end(key)
+                for chunk in cached:
+                    yield chunk
+                    # 再生中も他のタスクに制御を渡す
+                    await asyncio.sleep(0)
+                return
+            chunks: list[str] = []
+
         # Use the constructed messages for the current stream
+        # 履歴は呼び出し側が管理するため、インスタンスには会話の状態を保持しない
         async for chunk in self._model.astream(current_messages, **kwargs):
-            # Assuming chunk is already a string or has a text() method/attribute
-            # Adjust based on the actual return type of _model.astream
-            chunk_text = chunk.content if hasattr(chunk, "content") else str(chunk)
-            response_content += chunk_text
-            yield chunk_text
-
-        # Append the final AI response to the current messages list for context,
-        # but note this instance's _messages is not persisted across requests here.
-        # If persistence is needed, it should be handled differently.
-        current_messages.append(AIMessage(content=response_content))
-        # Update self._messages if you need to maintain state within the instance,
-        # though typically for stateless API calls, this might not be necessary.
-        self._messages = current_messages
+            if on_response_id is not None and (
+                response_id := chunk.response_metadata.get("id")
+            ):
+                on_response_id(response_id)
+            # Responses API では content がブロックのリストになるため text() で文字列を取り出す
+            text = chunk.text()
+            if use_cache:
+                chunks.append(text)
+            yield text
+
+        # 最後まで生成できた応答のみキャッシュする
+        if use_cache:
+            self._stream_cache[key] = chunks
+            if len(self._stream_cache) > STREAM_CACHE_SIZE:
+                self._stream_cache.popitem(last=False)
@@ -0,0 +1,9 @@
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+
+@lru_cache(maxsize=1)
+def load_env_once() -> bool:
+    """.envファイルから環境変数を読み込む (プロセス内で一度だけ実行される)"""
+    return load_dotenv()
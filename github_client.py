@@ -1,7 +1,94 @@
+import asyncio
+import logging
 import os
+import random
+import time
 import httpx
-import json
-from typing import Optional, Dict, Any, List
+import orjson
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, TypeVar
+
+# 読み取り専用の問い合わせ結果を保持する秒数
+LOOKUP_CACHE_TTL_SECONDS = 300.0
+# エラーメッセージに含めるレスポンスボディの最大バイト数
+MAX_ERROR_BODY_BYTES = 8192
+# レート制限やサーバーエラー時の最大試行回数と、再試行までの最大待ち秒数
+MAX_REQUEST_ATTEMPTS = 5
+MAX_RETRY_DELAY_SECONDS = 60.0
+
+# GraphQLクエリ (呼び出しごとに組み立てないようモジュールレベルで定義する)
+_REPOSITORY_ID_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    id
+  }
+}
+"""
+_PROJECT_V2_ID_QUERY = """
+query($owner: String!, $projectNumber: Int!) {
+  u: user(login: $owner) {
+    projectV2(number: $projectNumber) {
+      id
+    }
+  }
+  o: organization(login: $owner) {
+    projectV2(number: $projectNumber) {
+      id
+    }
+  }
+}
+"""
+_ADD_PROJECT_V2_ITEM_MUTATION = """
+mutation($projectId: ID!, $contentId: ID!) {
+  addProjectV2ItemById(input: {projectId: $projectId, contentId: $contentId}) {
+    item {
+      id
+    }
+  }
+}
+"""
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_delay(
+    response: httpx.Response, attempt: int, idempotent: bool
+) -> Optional[float]:
+    """
+    レスポンスが再試行すべきものであれば待ち秒数を返します。
+
+    レート制限 (429 / 残数0の403) はリクエストが処理されていないため常に再試行し、
+    5xx は重複作成を避けるため冪等なリクエストのみ再試行する。
+
+    Args:
+        response: APIからのレスポンス。
+        attempt: 0始まりの試行回数。
+        idempotent: 再送しても副作用が重複しないリクエストかどうか。
+
+    Returns:
+        再試行までの待ち秒数。再試行しない場合はNone。
+    """
+    status = response.status_code
+    rate_limited = status == 429 or (
+        status == 403
+        and (
+            response.headers.get("X-RateLimit-Remaining") == "0"
+            or "Retry-After" in response.headers
+        )
+    )
+    if not rate_limited and not (status >= 500 and idempotent):
+        return None
+
+    retry_after = response.headers.get("Retry-After")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if retry_after and retry_after.isdigit():
+        delay = float(retry_after)
+    elif rate_limited and reset and reset.isdigit():
+        delay = float(reset) - time.time()
+    else:
+        delay = 2**attempt + random.random()
+    return min(max(delay, 0.0), MAX_RETRY_DELAY_SECONDS)
 
 
 class GitHubClient:
@@ -30,6 +117,7 @@ class GitHubClient:
         self._headers = {
             "Authorization": f"Bearer {self._token}",
             "Accept": "application/vnd.github.v3+json",
+            "Content-Type": "application/json",
             "X-GitHub-Api-Version": "2022-11-28",  # 推奨されるバージョン指定
         }
         # GraphQL API用のヘッダーも用意
@@ -38,6 +126,62 @@ class GitHubClient:
             "Content-Type": "application/json",
         }
         self._graphql_url = f"{self._base_url}/graphql"
+        # 接続を使い回すため、クライアントはインスタンスで1つだけ保持する
+        self._client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {self._token}"},
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+        # リポジトリのNode ID (バッチ作成時に一度だけ取得する)
+        self._repository_id: Optional[str] = None
+        # 読み取り専用の問い合わせ結果 (キー -> (有効期限, 値)) と、キーごとのロック
+        self._lookup_cache: Dict[Tuple[Any, ...], Tuple[float, Any]] = {}
+        self._lookup_locks: Dict[Tuple[Any, ...], asyncio.Lock] = {}
+
+    async def aclose(self) -> None:
+        """保持しているHTTPクライアントを閉じます。"""
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "GitHubClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def _cached_lookup(
+        self,
+        key: Tuple[Any, ...],
+        fetch: Callable[[], Awaitable[Optional[T]]],
+        ttl: float = LOOKUP_CACHE_TTL_SECONDS,
+    ) -> Optional[T]:
+        """
+        読み取り専用の問い合わせ結果をTTL付きでキャッシュします。
+        同じキーへの同時アクセスはロックで1回の問い合わせにまとめます。
+        Issue作成などの更新系リクエストには使用しないでください。
+
+        Args:
+            key: キャッシュキー。
+            fetch: キャッシュがない場合に値を取得するコルーチン関数。
+            ttl: キャッシュの有効秒数。
+
+        Returns:
+            取得した値。Noneはキャッシュしない。
+        """
+        cached = self._lookup_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        lock = self._lookup_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # ロック待ちの間に他の呼び出しが取得済みであればそれを使う
+            cached = self._lookup_cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            value = await fetch()
+            if value is not None:
+                self._lookup_cache[key] = (time.monotonic() + ttl, value)
+            return value
 
     async def _request(
         self,
@@ -64,39 +208,54 @@ class GitHubClient:
         """
         url = self._graphql_url if is_graphql else f"{self._base_url}{endpoint}"
         headers = self._graphql_headers if is_graphql else self._headers
+        content = orjson.dumps(data) if data is not None else None
+        # GraphQLのmutationやPOSTなどは、サーバーエラー時に再送すると重複する恐れがある
+        if is_graphql:
+            idempotent = not (data or {}).get("query", "").lstrip().startswith(
+                "mutation"
+            )
+        else:
+            idempotent = method.upper() in ("GET", "HEAD", "PUT", "DELETE")
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.request(
-                    method, url, headers=headers, json=data, timeout=30.0
+        try:
+            for attempt in range(MAX_REQUEST_ATTEMPTS):
+                response = await self._client.request(
+                    method, url, headers=headers, content=content
                 )
-                response.raise_for_status()  # エラーがあれば例外を発生させる
-                # レスポンスボディがない場合 (e.g., 204 No Content) は空の辞書を返す
-                if response.status_code == 204:
-                    return {}
-                # レスポンスが空の場合も考慮
-                if not response.content:
-                    return {}
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                error_message = f"GitHub API Error ({e.response.status_code})"
-                try:
-                    # エラーレスポンスがJSON形式であれば詳細を追加
-                    error_details = e.response.json()
-                    error_message += f": {json.dumps(error_details)}"
-                except json.JSONDecodeError:
-                    # JSONでなければテキストとして追加
-                    error_message += f": {e.response.text}"
-                print(error_message)
-                # エラーメッセージを含めて再raiseする
-                raise httpx.HTTPStatusError(
-                    message=error_message,
-                    request=e.request,
-                    response=e.response,
-                ) from e
-            except Exception as e:
-                print(f"An unexpected error occurred during GitHub API request: {e}")
-                raise
+                delay = _retry_delay(response, attempt, idempotent)
+                if delay is None or attempt == MAX_REQUEST_ATTEMPTS - 1:
+                    break
+                logger.warning(
+                    "GitHub API returned %s, retrying in %.1fs (attempt %d/%d)",
+                    response.status_code,
+                    delay,
+                    attempt + 1,
+                    MAX_REQUEST_ATTEMPTS,
+                )
+                await asyncio.sleep(delay)
+            response.raise_for_status()  # エラーがあれば例外を発生させる
+            # レスポンスボディがない場合 (e.g., 204 No Content) は空の辞書を返す
+            raw = response.content
+            return orjson.loads(raw) if raw else {}
+        except httpx.HTTPStatusError as e:
+            # エラーレスポンスの本文は解析せず、そのまま (長い場合は先頭のみ) 追加する
+            raw = e.response.content
+            body = raw[:MAX_ERROR_BODY_BYTES].decode("utf-8", errors="replace")
+            if len(raw) > MAX_ERROR_BODY_BYTES:
+                body += f"... ({len(raw)} bytes, truncated)"
+            error_message = f"GitHub API Error ({e.response.status_code}): {body}"
+            logger.error(error_message)
+            # エラーメッセージを含めて再raiseする
+            raise httpx.HTTPStatusError(
+                message=error_message,
+                request=e.request,
+                response=e.response,
+            ) from e
+        except Exception as e:
+            logger.error(
+                "An unexpected error occurred during GitHub API request: %s", e
+            )
+            raise
 
     async def create_issue(
         self, title: str, body: Optional[str] = None, labels: Optional[List[str]] = None
@@ -119,13 +278,96 @@ class GitHubClient:
         if labels:
             payload["labels"] = labels
 
-        print(f"Creating issue '{title}' in {self._owner}/{self._repo}")
+        logger.info("Creating issue '%s' in %s/%s", title, self._owner, self._repo)
         return await self._request("POST", endpoint, data=payload)
 
+    async def get_repository_id(self) -> str:
+        """
+        リポジトリのNode IDを取得します。取得結果はインスタンス内で保持します。
+
+        Returns:
+            リポジトリのNode ID。
+
+        Raises:
+            ValueError: リポジトリが見つからない場合。
+        """
+        if self._repository_id:
+            return self._repository_id
+
+        variables = {"owner": self._owner, "name": self._repo}
+        payload = {"query": _REPOSITORY_ID_QUERY, "variables": variables}
+        response = await self._request("POST", "", data=payload, is_graphql=True)
+        repository = (response.get("data") or {}).get("repository")
+        if not repository or "id" not in repository:
+            raise ValueError(
+                f"Repository {self._owner}/{self._repo} not found: {response.get('errors')}"
+            )
+        self._repository_id = repository["id"]
+        return self._repository_id
+
+    async def create_issues_batch(
+        self, issues: List[Dict[str, str]]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        複数のIssueを1回のGraphQLリクエストでまとめて作成します。
+
+        Args:
+            issues: "title" と "body" を持つ辞書のリスト。
+
+        Returns:
+            入力と同じ順序のリスト。各要素は create_issue と同じキー
+            (node_id, number, html_url) を持つ辞書。作成に失敗したIssueはNone。
+        """
+        if not issues:
+            return []
+
+        repository_id = await self.get_repository_id()
+        variable_defs = ["$repositoryId: ID!"]
+        fields = []
+        variables: Dict[str, Any] = {"repositoryId": repository_id}
+        for i, issue in enumerate(issues):
+            variable_defs.append(f"$title{i}: String!, $body{i}: String")
+            fields.append(
+                f"i{i}: createIssue(input: {{repositoryId: $repositoryId, "
+                f"title: $title{i}, body: $body{i}}}) {{ issue {{ id number url }} }}"
+            )
+            variables[f"title{i}"] = issue.get("title", "")
+            variables[f"body{i}"] = issue.get("body") or None
+        mutation = (
+            f"mutation({', '.join(variable_defs)}) {{\n" + "\n".join(fields) + "\n}"
+        )
+        payload = {"query": mutation, "variables": variables}
+
+        logger.info(
+            "Creating %d issues in %s/%s", len(issues), self._owner, self._repo
+        )
+        response = await self._request("POST", "", data=payload, is_graphql=True)
+        if response.get("errors"):
+            logger.warning(
+                "GraphQL errors when creating issues: %s", response["errors"]
+            )
+
+        data = response.get("data") or {}
+        created: List[Optional[Dict[str, Any]]] = []
+        for i in range(len(issues)):
+            issue_data = (data.get(f"i{i}") or {}).get("issue")
+            if issue_data and "id" in issue_data:
+                created.append(
+                    {
+                        "node_id": issue_data["id"],
+                        "number": issue_data.get("number"),
+                        "html_url": issue_data.get("url"),
+                    }
+                )
+            else:
+                created.append(None)
+        return created
+
     async def get_project_v2_id(self, project_number: int) -> Optional[str]:
         """
         指定されたプロジェクト番号に対応するProjectV2のNode IDを取得します。
         オーナーがユーザーまたはOrganizationのどちらでも動作するように試みます。
+        取得結果は一定時間キャッシュされます。
 
         Args:
             project_number: プロジェクトの番号。
@@ -133,88 +375,55 @@ class GitHubClient:
         Returns:
             ProjectV2のNode ID。見つからない場合はNone。
         """
-        # まずユーザーとして試す
-        user_query = """
-        query($owner: String!, $projectNumber: Int!) {
-          user(login: $owner) {
-            projectV2(number: $projectNumber) {
-              id
-            }
-          }
-        }
+        return await self._cached_lookup(
+            ("project_v2_id", self._owner, project_number),
+            lambda: self._fetch_project_v2_id(project_number),
+        )
+
+    async def _fetch_project_v2_id(self, project_number: int) -> Optional[str]:
+        """get_project_v2_id のキャッシュを介さない実装
+
+        ユーザーとOrganizationの両方をエイリアス付きの1つのクエリで問い合わせる。
         """
         variables = {"owner": self._owner, "projectNumber": project_number}
-        user_payload = {"query": user_query, "variables": variables}
+        payload = {"query": _PROJECT_V2_ID_QUERY, "variables": variables}
 
-        print(
-            f"Attempting to fetch ProjectV2 ID for project number {project_number} as user '{self._owner}'"
+        logger.debug(
+            "Attempting to fetch ProjectV2 ID for project number %s as user or organization '%s'",
+            project_number,
+            self._owner,
         )
         try:
-            response = await self._request(
-                "POST", "", data=user_payload, is_graphql=True
+            response = await self._request("POST", "", data=payload, is_graphql=True)
+        except httpx.HTTPStatusError as e:
+            logger.warning(
+                "Fetching ProjectV2 ID failed (HTTP %s). Project not found or access issue.",
+                e.response.status_code,
             )
-            project_data = response.get("data", {}).get("user", {}).get("projectV2")
+            return None
+        except Exception as e:
+            logger.error("Unexpected error fetching ProjectV2 ID: %s", e)
+            return None
+
+        data = response.get("data") or {}
+        for alias, owner_type in (("u", "user"), ("o", "organization")):
+            project_data = (data.get(alias) or {}).get("projectV2")
             if project_data and "id" in project_data:
                 project_id = project_data["id"]
-                print(f"Found ProjectV2 ID (as user): {project_id}")
+                logger.info("Found ProjectV2 ID (as %s): %s", owner_type, project_id)
                 return project_id
-            # ユーザーとして見つからなかった場合、エラーが含まれているか確認
-            elif response.get("errors"):
-                print(f"GraphQL errors when fetching as user: {response['errors']}")
-                # Organizationとして試行を続ける
 
-        except httpx.HTTPStatusError as e:
-            # 404などは想定内としてOrganization検索へ
-            print(
-                f"Fetching as user failed (HTTP {e.response.status_code}), trying as organization."
-            )
-        except Exception as e:
-            print(f"Unexpected error fetching ProjectV2 ID as user: {e}")
-            # 予期せぬエラーでもOrganizationとして試す価値はあるかもしれない
-
-        # Organizationとして試す
-        org_query = """
-        query($owner: String!, $projectNumber: Int!) {
-          organization(login: $owner) {
-            projectV2(number: $projectNumber) {
-              id
-            }
-          }
-        }
-        """
-        org_payload = {"query": org_query, "variables": variables}
-        print(
-            f"Attempting to fetch ProjectV2 ID for project number {project_number} as organization '{self._owner}'"
+        # オーナー種別が違う側のエラー (NOT_FOUND) は想定内なので、
+        # どちらからも見つからなかった場合にだけ表示する
+        errors = response.get("errors")
+        if errors:
+            logger.warning("GraphQL errors when fetching ProjectV2 ID: %s", errors)
+        logger.warning(
+            "ProjectV2 with number %s not found for owner '%s' (checked as user and organization).",
+            project_number,
+            self._owner,
         )
-        try:
-            org_response = await self._request(
-                "POST", "", data=org_payload, is_graphql=True
-            )
-            org_project_data = (
-                org_response.get("data", {}).get("organization", {}).get("projectV2")
-            )
-            if org_project_data and "id" in org_project_data:
-                project_id = org_project_data["id"]
-                print(f"Found ProjectV2 ID (as organization): {project_id}")
-                return project_id
-            else:
-                # Organizationとしても見つからなかった場合
-                errors = org_response.get("errors")
-                if errors:
-                    print(f"GraphQL errors when fetching as organization: {errors}")
-                else:
-                    print(
-                        f"ProjectV2 with number {project_number} not found for owner '{self._owner}' (checked as user and organization). Response: {org_response}"
-                    )
-                return None
-        except httpx.HTTPStatusError as e:
-            print(
-                f"Fetching as organization failed (HTTP {e.response.status_code}). Project not found or access issue."
-            )
-            return None
-        except Exception as e:
-            print(f"Unexpected error fetching ProjectV2 ID as organization: {e}")
-            return None
+        return None
 
     async def add_issue_to_project_v2(
         self, project_id: str, issue_node_id: str
@@ -229,27 +438,22 @@ class GitHubClient:
         Returns:
             追加されたプロジェクトアイテムのID。失敗した場合はNone。
         """
-        mutation = """
-        mutation($projectId: ID!, $contentId: ID!) {
-          addProjectV2ItemById(input: {projectId: $projectId, contentId: $contentId}) {
-            item {
-              id
-            }
-          }
-        }
-        """
         variables = {"projectId": project_id, "contentId": issue_node_id}
-        payload = {"query": mutation, "variables": variables}
+        payload = {"query": _ADD_PROJECT_V2_ITEM_MUTATION, "variables": variables}
 
-        print(
-            f"Adding issue (Node ID: {issue_node_id}) to project (Node ID: {project_id})"
+        logger.info(
+            "Adding issue (Node ID: %s) to project (Node ID: %s)",
+            issue_node_id,
+            project_id,
         )
         try:
             response = await self._request("POST", "", data=payload, is_graphql=True)
             # エラーチェックを先に行う
             errors = response.get("errors")
             if errors:
-                print(f"Failed to add issue to project. GraphQL Errors: {errors}")
+                logger.warning(
+                    "Failed to add issue to project. GraphQL Errors: %s", errors
+                )
                 return None
 
             item_data = (
@@ -257,22 +461,74 @@ class GitHubClient:
             )
             if item_data and "id" in item_data:
                 item_id = item_data["id"]
-                print(f"Successfully added issue to project. Item ID: {item_id}")
+                logger.info("Successfully added issue to project. Item ID: %s", item_id)
                 return item_id
             else:
                 # データ構造が予期しない場合
-                print(
-                    f"Failed to add issue to project. Unexpected response structure: {response}"
+                logger.warning(
+                    "Failed to add issue to project. Unexpected response structure: %s",
+                    response,
                 )
                 return None
         except httpx.HTTPStatusError as e:
             # HTTPレベルのエラーもここでキャッチ
-            print(f"Failed to add issue to project due to HTTP error: {e}")
+            logger.error("Failed to add issue to project due to HTTP error: %s", e)
             return None
         except Exception as e:
-            print(f"Unexpected error adding issue to project: {e}")
+            logger.error("Unexpected error adding issue to project: %s", e)
             return None
 
+    async def add_issues_to_project_batch(
+        self, project_id: str, issue_node_ids: List[str]
+    ) -> List[Optional[str]]:
+        """
+        複数のIssueを1回のGraphQLリクエストでまとめてProjectV2に追加します。
+
+        Args:
+            project_id: 追加先のProjectV2のNode ID。
+            issue_node_ids: 追加するIssueのNode IDのリスト。
+
+        Returns:
+            入力と同じ順序の、追加されたプロジェクトアイテムのIDのリスト。
+            失敗したIssueはNone。
+        """
+        if not issue_node_ids:
+            return []
+
+        variable_defs = ["$projectId: ID!"]
+        fields = []
+        variables: Dict[str, Any] = {"projectId": project_id}
+        for i, issue_node_id in enumerate(issue_node_ids):
+            variable_defs.append(f"$contentId{i}: ID!")
+            fields.append(
+                f"p{i}: addProjectV2ItemById(input: {{projectId: $projectId, "
+                f"contentId: $contentId{i}}}) {{ item {{ id }} }}"
+            )
+            variables[f"contentId{i}"] = issue_node_id
+        mutation = (
+            f"mutation({', '.join(variable_defs)}) {{\n" + "\n".join(fields) + "\n}"
+        )
+        payload = {"query": mutation, "variables": variables}
+
+        logger.info(
+            "Adding %d issues to project (Node ID: %s)", len(issue_node_ids), project_id
+        )
+        try:
+            response = await self._request("POST", "", data=payload, is_graphql=True)
+        except Exception as e:
+            logger.error("Failed to add issues to project: %s", e)
+            return [None] * len(issue_node_ids)
+        if response.get("errors"):
+            logger.warning(
+                "GraphQL errors when adding issues to project: %s", response["errors"]
+            )
+
+        data = response.get("data") or {}
+        return [
+            ((data.get(f"p{i}") or {}).get("item") or {}).get("id")
+            for i in range(len(issue_node_ids))
+        ]
+
 
 # --- 以下、テスト用のコード (本番利用時は削除またはコメントアウト) ---
 async def _main_test():
@@ -280,6 +536,8 @@ async def _main_test():
     from dotenv import load_dotenv
 
     load_dotenv()  # .envファイルを読み込む
+    # クライアント内部のログもコンソールに出力する
+    logging.basicConfig(level=logging.INFO)
     github_token = os.getenv("GITHUB_PAT")
     github_owner = os.getenv("GITHUB_OWNER")
     github_repo = os.getenv("GITHUB_REPO")
@@ -297,64 +555,62 @@ async def _main_test():
         print("GITHUB_PROJECT_NUMBER は整数である必要があります。")
         return
 
-    client = GitHubClient(token=github_token, owner=github_owner, repo=github_repo)
-
-    try:
-        # 1. プロジェクトIDを取得
-        print("\n--- 1. Fetching Project ID ---")
-        project_id = await client.get_project_v2_id(project_number)
-        if not project_id:
-            print("プロジェクトIDの取得に失敗しました。処理を終了します。")
-            return
-        print(f"Project ID: {project_id}")
-
-        # 2. テストIssueを作成
-        print("\n--- 2. Creating Test Issue ---")
-        issue_title = f"Test Issue from GitHubClient ({os.urandom(4).hex()})"
-        created_issue = await client.create_issue(
-            title=issue_title,
-            body="This is a test issue created by the GitHubClient class.",
-            labels=["test", "automated"],
-        )
-        issue_node_id = created_issue.get("node_id")
-        issue_number = created_issue.get("number")
-        issue_html_url = created_issue.get("html_url")
-
-        if not issue_node_id:
-            print("Issueの作成に成功しましたが、Node IDが取得できませんでした。")
-            print(f"Created Issue Response: {created_issue}")
-            return
-        print(f"Test issue created: #{issue_number} (Node ID: {issue_node_id})")
-        print(f"Issue URL: {issue_html_url}")
-
-        # 3. Issueをプロジェクトに追加
-        print("\n--- 3. Adding Issue to Project ---")
-        item_id = await client.add_issue_to_project_v2(project_id, issue_node_id)
-
-        if item_id:
-            print(
-                f"Issue #{issue_number} successfully added to project {project_number} (Project ID: {project_id})."
+    async with GitHubClient(
+        token=github_token, owner=github_owner, repo=github_repo
+    ) as client:
+        try:
+            # 1. プロジェクトIDを取得
+            print("\n--- 1. Fetching Project ID ---")
+            project_id = await client.get_project_v2_id(project_number)
+            if not project_id:
+                print("プロジェクトIDの取得に失敗しました。処理を終了します。")
+                return
+            print(f"Project ID: {project_id}")
+
+            # 2. テストIssueを作成
+            print("\n--- 2. Creating Test Issue ---")
+            issue_title = f"Test Issue from GitHubClient ({os.urandom(4).hex()})"
+            created_issue = await client.create_issue(
+                title=issue_title,
+                body="This is a test issue created by the GitHubClient class.",
+                labels=["test", "automated"],
             )
-            print(f"Project Item ID: {item_id}")
-        else:
-            print(f"Failed to add issue #{issue_number} to project {project_number}.")
-
-    except httpx.HTTPStatusError as e:
-        print(f"\n--- Error ---")
-        print(f"An HTTP error occurred: {e}")
-        # エラーレスポンスの詳細を表示 (既に _request 内で表示されるが念のため)
-        # print(f"Response body: {e.response.text}")
-    except Exception as e:
-        print(f"\n--- Error ---")
-        print(f"An unexpected error occurred: {e}")
-        import traceback
-
-        traceback.print_exc()
-
-
-# if __name__ == "__main__":
-#     import asyncio
-#     from dotenv import load_dotenv
-#     # テスト実行時は .env ファイルを読み込む
-#     # load_dotenv() # _main_test 内で実行される
-#     # asyncio.run(_main_test())
+            issue_node_id = created_issue.get("node_id")
+            issue_number = created_issue.get("number")
+            issue_html_url = created_issue.get("html_url")
+
+            if not issue_node_id:
+                print("Issueの作成に成功しましたが、Node IDが取得できませんでした。")
+                print(f"Created Issue Response: {created_issue}")
+                return
+            print(f"Test issue created: #{issue_number} (Node ID: {issue_node_id})")
+            print(f"Issue URL: {issue_html_url}")
+
+            # 3. Issueをプロジェクトに追加
+            print("\n--- 3. Adding Issue to Project ---")
+            item_id = await client.add_issue_to_project_v2(project_id, issue_node_id)
+
+            if item_id:
+                print(
+                    f"Issue #{issue_number} successfully added to project {project_number} (Project ID: {project_id})."
+                )
+                print(f"Project Item ID: {item_id}")
+            else:
+                print(f"Failed to add issue #{issue_number} to project {project_number}.")
+
+        except httpx.HTTPStatusError as e:
+            print(f"\n--- Error ---")
+            print(f"An HTTP error occurred: {e}")
+            # エラーレスポンスの詳細を表示 (既に _request 内で表示されるが念のため)
+            # print(f"Response body: {e.response.text}")
+        except Exception as e:
+            print(f"\n--- Error ---")
+            print(f"An unexpected error occurred: {e}")
+            import traceback
+
+            traceback.print_exc()
+
+
+if __name__ == "__main__":
+    # テスト実行時のみ動かす (.env は _main_test 内で読み込む)
+    asyncio.run(_main_test())
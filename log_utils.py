@@ -0,0 +1,41 @@
+import logging
+import logging.handlers
+import os
+import queue
+
+# ログの書き出しはリスナースレッドに任せ、イベントループ上ではキューへの追加のみ行う
+_LOG_QUEUE: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(
+    logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+)
+_LOG_LISTENER = logging.handlers.QueueListener(_LOG_QUEUE, _log_stream_handler)
+_listener_started = False
+
+
+def setup_queue_logging(*names: str) -> logging.handlers.QueueListener:
+    """
+    指定したロガーの出力をキュー経由にし、書き出し用のリスナーを開始します。
+    APP_DEBUG=1 のときはデバッグログも出力します。
+
+    Args:
+        names: キュー経由にするロガー名。
+
+    Returns:
+        ログを書き出すリスナー。アプリ終了時に stop() を呼び出す。
+    """
+    global _listener_started
+    level = logging.DEBUG if os.getenv("APP_DEBUG") == "1" else logging.INFO
+    for name in names:
+        target = logging.getLogger(name)
+        if not any(
+            isinstance(handler, logging.handlers.QueueHandler)
+            for handler in target.handlers
+        ):
+            target.addHandler(logging.handlers.QueueHandler(_LOG_QUEUE))
+        target.setLevel(level)
+        target.propagate = False
+    if not _listener_started:
+        _LOG_LISTENER.start()
+        _listener_started = True
+    return _LOG_LISTENER
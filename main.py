@@ -1,43 +1,133 @@
-from typing import TypedDict, Annotated, Sequence
-import operator
+from collections import deque
+from types import MappingProxyType
+from typing import TypedDict, Annotated, Any, Mapping, Sequence, Final
+import logging
 
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langgraph.graph import StateGraph, END
 import chainlit as cl
 
+from chatbot import SUMMARIZE_THRESHOLD
 from planner import PlannerBot
 from tech_spec import TechSpecBot
+from token_batcher import TokenBatcher
+from log_utils import setup_queue_logging
 
-from dotenv import load_dotenv
+# .env は chainlit と planner / tech_spec のインポート時に読み込まれるため、ここでは読み込まない
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+setup_queue_logging(__name__)
+
+# プランナーは会話ごとの状態を持たないため、プロセス内で1つだけ生成して共有する
+planner_bot = PlannerBot()
+
+
+# 状態に保持するメッセージの上限 (超えた分は古いものから破棄される)
+MAX_MESSAGES = 64
+
+# 状態には (役割, 本文) のタプルだけを保持し、BaseMessage はモデルに渡す時点で生成する
+ChatTurn = tuple[str, str]
+_USER_ROLE = "user"
+_AI_ROLE = "ai"
+
+
+def append_messages(
+    current: Sequence[ChatTurn], new: Sequence[ChatTurn]
+) -> deque[ChatTurn]:
+    """
+    メッセージを上限付きのdequeに追加するreducer。
+
+    LangGraphは条件分岐の評価時にチャネルを浅くコピーしてreducerを適用するため、
+    既存のdequeは変更せず新しいdequeを返す。上限があるのでコピーの量も一定に収まる。
+    """
+    merged = deque(current, maxlen=MAX_MESSAGES)
+    merged.extend(new)
+    return merged
 
 
 # 状態定義
 class AgentState(TypedDict):
-    messages: Annotated[Sequence[BaseMessage], operator.add]
+    messages: Annotated[deque[ChatTurn], append_messages]
     plan: str
     tech_spec: str
     is_plan_finished: bool
 
 
-async def run_planner(state: AgentState):
-    print("--- Running Planner ---")
-    planner_bot: PlannerBot = cl.user_session.get("planner_bot")
-    if planner_bot is None:
-        raise RuntimeError("PlannerBotが初期化されていません。")
+# 新しい会話の初期状態 (読み取り専用。messages は呼び出し側が会話ごとに新しい deque を割り当てる)
+_INITIAL_STATE: Final[Mapping[str, Any]] = MappingProxyType(
+    {"plan": "", "tech_spec": "", "is_plan_finished": False}
+)
+
+# ストリーミング開始前に表示するメッセージ
+# 応答本文は stream_token によりこの後ろに連結されるため、取り出す際に読み飛ばす
+_PLANNER_PLACEHOLDER = "プランニング中..."
+_TECH_SPEC_PLACEHOLDER = "技術仕様作成中..."
+# プランナーが企画の完成を示すキーワード
+_DONE_MARKER = "[完了]"
+# プランナーの直前の応答ID (Responses API の previous_response_id) を保持するキー
+_PLANNER_RESPONSE_ID_KEY = "planner_response_id"
+
+
+def _to_base_messages(turns: Sequence[ChatTurn]) -> list[BaseMessage]:
+    """状態に保持している会話をモデルに渡すメッセージに変換する"""
+    return [
+        HumanMessage(content=text) if role == _USER_ROLE else AIMessage(content=text)
+        for role, text in turns
+    ]
+
+
+def _plan_content(response: str) -> str:
+    """プランナーの応答から技術仕様の入力となる企画を取り出す"""
+    return response.replace(_DONE_MARKER, "").strip()
 
-    last_message = state["messages"][-1].content
-    response = ""
-    is_finished = False
+
+async def run_planner(state: AgentState):
+    logger.info("--- Running Planner ---")
+    last_message = state["messages"][-1][1]
+
+    # 履歴が要約の閾値を超えたら応答IDの連鎖をやめ、要約した履歴を送る
+    # (連鎖したままではサーバー側の会話が際限なく伸び、毎回すべて入力として課金される)
+    chain_responses = len(state["messages"]) - 1 <= SUMMARIZE_THRESHOLD
+    # 直前の応答IDがあれば会話の続きはサーバー側が保持しているので、今回の発言のみ送る
+    previous_response_id = (
+        cl.user_session.get(_PLANNER_RESPONSE_ID_KEY) if chain_responses else None
+    )
+    if previous_response_id:
+        history = None
+        stream_kwargs = {"previous_response_id": previous_response_id}
+    else:
+        # 応答IDがない場合は状態に残っている履歴をすべて送る (長い履歴は Chatbot 側で要約される)
+        history = _to_base_messages(list(state["messages"])[:-1])
+        stream_kwargs = {}
+    response_ids: list[str] = []
 
     try:
-        msg = cl.Message(content="プランニング中...")
+        msg = cl.Message(content=_PLANNER_PLACEHOLDER)
         await msg.send()
 
-        async for chunk in planner_bot.stream(last_message):
-            response += chunk
-            await msg.stream_token(chunk)
+        batcher = TokenBatcher(msg)
+        # 完了キーワードがチャンクをまたいでも検出できるよう、直前の末尾を保持する
+        tail = ""
+        is_finished = False
+        async for chunk in planner_bot.stream(
+            last_message,
+            history=history,
+            on_response_id=response_ids.append,
+            **stream_kwargs,
+        ):
+            await batcher.push(chunk)
+            # 「完了」キーワードはストリーミング中に検出し、応答全体は走査しない
+            if not is_finished:
+                window = tail + chunk
+                is_finished = _DONE_MARKER in window
+                tail = window[-(len(_DONE_MARKER) - 1) :]
+        await batcher.flush()
+        # 応答本文はメッセージ側に蓄積されているので、別途連結せずに取り出す
+        response = msg.content[len(_PLANNER_PLACEHOLDER) :]
+        cl.user_session.set(
+            _PLANNER_RESPONSE_ID_KEY,
+            response_ids[-1] if chain_responses and response_ids else None,
+        )
 
         # 進行中メッセージを更新完了
         await msg.update()
@@ -46,23 +136,18 @@ async def run_planner(state: AgentState):
         # result_msg = cl.Message(content=response)
         # await result_msg.send()
 
-        # 「完了」キーワードを見て強制的にフラグを立てる
-        if "[完了]" in response:
-            is_finished = True
-
-        new_messages = state["messages"] + [AIMessage(content=response)]
-
+        # reducerが既存のメッセージに追加するため、追加分のみ返す
         return {
-            **state,
-            "messages": new_messages,
+            "messages": [(_AI_ROLE, response)],
             "plan": response,
             "is_plan_finished": is_finished,
         }
     except Exception as e:
-        print(f"Error in Planner: {e}")
+        logger.exception("Error in Planner: %s", e)
+        # 応答IDが失効している可能性があるため、次回は履歴をすべて送る
+        cl.user_session.set(_PLANNER_RESPONSE_ID_KEY, None)
         await cl.Message(content=f"プランナーエラー: {e}").send()
         return {
-            **state,
             "plan": "プランニング失敗",
             "tech_spec": "",
             "is_plan_finished": False,
@@ -70,20 +155,20 @@ async def run_planner(state: AgentState):
 
 
 async def run_tech_spec(state: AgentState):
-    print("--- Running Tech Spec ---")
-    tech_spec_bot: TechSpecBot = cl.user_session.get("tech_spec_bot")
-    if tech_spec_bot is None:
-        raise RuntimeError("TechSpecBotが初期化されていません。")
-
-    plan_content = state["plan"].replace("[完了]", "").strip()
-    response = ""
+    logger.info("--- Running Tech Spec ---")
+    plan_content = _plan_content(state["plan"])
+    # TechSpecBotはシステムプロンプトに企画を含むため、企画が確定した時点で生成する
+    tech_spec_bot = TechSpecBot(plan_content)
     try:
-        msg = cl.Message(content="技術仕様作成中...")
+        msg = cl.Message(content=_TECH_SPEC_PLACEHOLDER)
         await msg.send()
 
+        batcher = TokenBatcher(msg)
         async for chunk in tech_spec_bot.stream(plan_content):
-            response += chunk
-            await msg.stream_token(chunk)
+            await batcher.push(chunk)
+        await batcher.flush()
+        # 応答本文はメッセージ側に蓄積されているので、別途連結せずに取り出す
+        response = msg.content[len(_TECH_SPEC_PLACEHOLDER) :]
 
         # 完了メッセージを明示的に送信
         await msg.update()
@@ -92,24 +177,19 @@ async def run_tech_spec(state: AgentState):
         # result_msg = cl.Message(content=response)
         # await result_msg.send()
 
-        new_messages = state["messages"] + [AIMessage(content=response)]
-
         return {
-            **state,
-            "messages": new_messages,
+            "messages": [(_AI_ROLE, response)],
             "tech_spec": response,
         }
     except Exception as e:
-        print(f"Error in Tech Spec: {e}")
+        logger.exception("Error in Tech Spec: %s", e)
         await cl.Message(content=f"技術仕様エラー: {e}").send()
         return {
-            **state,
             "tech_spec": "技術仕様生成失敗",
         }
 
 
 def should_run_tech_spec(state: AgentState) -> str:
-    print(f"--- is_plan_finished: {state['is_plan_finished']} ---")
     return "tech" if state["is_plan_finished"] else END
 
 
@@ -130,8 +210,6 @@ app = workflow.compile()
 @cl.on_chat_start
 async def start_chat():
     await cl.Message(content="こんにちは！アイデアを教えてください！").send()
-    cl.user_session.set("planner_bot", PlannerBot())
-    cl.user_session.set("tech_spec_bot", TechSpecBot())
 
 
 @cl.on_message
@@ -142,35 +220,28 @@ async def main(message: cl.Message):
 
     # ここでセッションから前回の状態を取る
     previous_state = cl.user_session.get("agent_state")
+    human_message = (_USER_ROLE, user_input)
 
     if previous_state is None:
-        # セッションに何もなければ新規作成
-        agent_state = AgentState(
-            messages=[HumanMessage(content=user_input)],
-            plan="",
-            tech_spec="",
-            is_plan_finished=False,
-        )
+        # セッションに何もなければ初期状態から作成
+        agent_state = {
+            **_INITIAL_STATE,
+            "messages": deque([human_message], maxlen=MAX_MESSAGES),
+        }
     else:
-        # 前回のmessagesに追記していく
+        # 前回のmessagesに追記していく (reducerが上限付きのdequeにまとめる)
         agent_state = {
             **previous_state,
-            "messages": previous_state["messages"] + [HumanMessage(content=user_input)],
+            "messages": [*previous_state["messages"], human_message],
         }
 
-    final_state = None
-
     # グラフ実行
     final_state = agent_state  # 初期値として現在の状態を設定
-    async for event in app.astream(agent_state):
-        # 各ノードの実行後の状態を取得
-        if isinstance(event, dict):
-            if event.get("planner"):
-                final_state = event["planner"]
-            elif event.get("tech"):
-                final_state = event["tech"]
-
-    print(f"Final State: {final_state}")
+    # stream_mode="values" では各ノードの実行後の状態全体が得られる
+    async for event in app.astream(agent_state, stream_mode="values"):
+        final_state = event
+
+    logger.debug("Final State: %s", final_state)
     if final_state:
         # セッションに保存（次回使うため）
         cl.user_session.set("agent_state", final_state)
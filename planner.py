@@ -1,14 +1,18 @@
 import os
+from functools import cached_property
 from chatbot import Chatbot
-from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage
+from env_utils import load_env_once
 
 try:
     from langchain_openai import ChatOpenAI
 except ImportError:
     from langchain.chat_models import ChatOpenAI
-from typing import Optional
+from typing import Optional, Sequence, Union
 
-load_dotenv()
+load_env_once()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 
 class PlannerBot(Chatbot):
@@ -20,16 +24,18 @@ class PlannerBot(Chatbot):
         super().__init__()
         self.__last_message: Optional[str] = None
 
-    @property
+    @cached_property
     def _model(self):
         """
         モデルのプロパティを取得する抽象メソッド。
         """
         return ChatOpenAI(
             model="gpt-4o-mini",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            openai_api_key=OPENAI_API_KEY,
             streaming=True,
             temperature=0.7,
+            # 会話の状態をサーバー側に保持し、previous_response_id で続きから応答させる
+            use_responses_api=True,
         )
 
     @property
@@ -53,7 +59,12 @@ class PlannerBot(Chatbot):
         - 「企画ファイル」のようなタイトルは不要
         """
 
-    async def stream(self, user_message: str, history: list = None, **kwargs):
+    async def stream(
+        self,
+        user_message: str,
+        history: Optional[Sequence[Union[BaseMessage, dict]]] = None,
+        **kwargs,
+    ):
         response = ""
         content = kwargs.get("content", "")
         # Remove 'content' and 'history' from kwargs if they exist,
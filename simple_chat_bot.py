@@ -2,10 +2,10 @@ import chainlit as cl
 from planner import PlannerBot
 from tech_spec import TechSpecBot
 
-from dotenv import load_dotenv
+from env_utils import load_env_once
 
-# .envファイルから環境変数を読み込む (PlannerBot内でも読み込まれるが念のため)
-load_dotenv()
+# .envファイルから環境変数を読み込む (PlannerBot内でも呼ばれるが、読み込みは一度だけ)
+load_env_once()
 
 # グローバルなPlannerBotインスタンス
 bot = TechSpecBot()
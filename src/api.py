@@ -1,3 +1,5 @@
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from routers import chat, documents, projects, issues
@@ -8,31 +10,34 @@ from routers.utils import (
     get_issue_repository,
 )
 
+logger = logging.getLogger("uvicorn")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load the ML model
-    print("Initializing repositories...")
+    logger.info("Initializing repositories...")
     # 各リポジトリのインスタンスを取得して初期化をトリガー
+    # initialize は各リポジトリの基底クラスで定義されているため、そのまま呼び出す
+    # boto3 のデフォルトセッションはスレッドセーフではないため、インスタンスはこのスレッドで生成する
     plan_repo = get_plan_document_repository()
-    if hasattr(plan_repo, "initialize"):  # DynamoDB実装の場合のみ初期化
-        plan_repo.initialize("PlanningDocuments")
-
     tech_spec_repo = get_tech_spec_document_repository()
-    if hasattr(tech_spec_repo, "initialize"):
-        tech_spec_repo.initialize("TechSpecDocuments")
-
-    get_project_repository()  # これでProjectテーブルも初期化される
-    # initializeはget_project_repository内で呼ばれるためここでは不要
-
+    project_repo = get_project_repository(initialize=False)
     issue_repo = get_issue_repository()
-    if hasattr(issue_repo, "initialize"):
-        issue_repo.initialize()
 
-    print("Repositories initialized.")
+    # テーブルの作成・確認はDynamoDBへの同期的な通信で待ち時間が大半のため、
+    # スレッドで並行して実行する
+    await asyncio.gather(
+        asyncio.to_thread(plan_repo.initialize, "PlanningDocuments"),
+        asyncio.to_thread(tech_spec_repo.initialize, "TechSpecDocuments"),
+        asyncio.to_thread(project_repo.initialize, "Projects"),
+        asyncio.to_thread(issue_repo.initialize),
+    )
+
+    logger.info("Repositories initialized.")
     yield
     # Clean up the ML models and release the resources
-    print("Cleaning up resources...")  # 必要であれば終了処理を追加
+    logger.info("Cleaning up resources...")  # 必要であれば終了処理を追加
 
 
 app = FastAPI(lifespan=lifespan)
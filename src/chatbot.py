@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Optional
 from langchain_core.language_models.chat_models import BaseChatModel
+from config import OPENAI_API_KEY
 from langchain.schema import (
     AIMessage,
     BaseMessage,
@@ -8,8 +9,57 @@ from langchain.schema import (
     SystemMessage,
 )
 
+try:
+    from langchain_openai import ChatOpenAI
+except ImportError:
+    from langchain.chat_models import ChatOpenAI
+
+_shared_chat_model: Optional[BaseChatModel] = None
+
+
+def get_shared_chat_model() -> BaseChatModel:
+    """
+    全てのボットで共有するチャットモデルを返します。
+    モデル自体は会話の状態を持たないため、リクエストをまたいで使い回す。
+    OpenAIを使わないルートに影響しないよう、最初のチャットリクエストの時点で生成する。
+    """
+    global _shared_chat_model
+    if _shared_chat_model is None:
+        _shared_chat_model = ChatOpenAI(
+            model="gpt-4o-mini",
+            openai_api_key=OPENAI_API_KEY,
+            streaming=True,
+            temperature=0.7,
+        )
+    return _shared_chat_model
+
+
+def _apply_sink_window(
+    messages: list[BaseMessage], sink: int, recent: int
+) -> list[BaseMessage]:
+    """
+    先頭のシステムメッセージと最初の sink 件、直近の recent 件だけを残し、
+    中間のメッセージを取り除きます。
+
+    Args:
+        messages: 先頭がシステムメッセージのメッセージリスト。
+        sink: 常に残す会話冒頭のメッセージ数。
+        recent: 常に残す直近のメッセージ数。
+
+    Returns:
+        件数が上限以下ならそのままのリスト、超えていれば間引いたリスト。
+    """
+    if len(messages) <= 1 + sink + recent:
+        return messages
+    return messages[: 1 + sink] + messages[-recent:]
+
 
 class Chatbot(ABC):
+    # 履歴を間引く際に残す会話冒頭のメッセージ数 (システムメッセージを除く)
+    SINK_MESSAGES = 4
+    # 履歴を間引く際に残す直近のメッセージ数
+    RECENT_MESSAGES = 8
+
     def __init__(self):
         self._messages: list[BaseMessage] = []
         self._messages.append(
@@ -42,9 +92,14 @@ class Chatbot(ABC):
         Returns:
             生成された応答テキスト。
         """
-        response_content = ""
+        chunks: list[str] = []
         self._messages.append(HumanMessage(content=user_message))
         for chunk in self._model.stream(self._messages):
-            response_content += chunk.text()
-            yield chunk.text()
-        self._messages.append(AIMessage(content=response_content))
+            chunk_text = chunk.text()
+            chunks.append(chunk_text)
+            yield chunk_text
+        self._messages.append(AIMessage(content="".join(chunks)))
+        # 長い会話でもコンテキスト長を超えないよう履歴を一定件数に保つ
+        self._messages = _apply_sink_window(
+            self._messages, self.SINK_MESSAGES, self.RECENT_MESSAGES
+        )
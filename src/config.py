@@ -1,5 +1,13 @@
 import os
 
+from env_utils import load_env_once
+
+# 環境変数はプロセス起動時にここで一度だけ読み込み、各モジュールはこの値を参照する
+load_env_once()
+
+# OpenAI configuration
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
 # DynamoDB configuration
 DYNAMODB_ENDPOINT = os.environ.get("DYNAMODB_ENDPOINT", "http://localhost:8000")
 AWS_REGION = os.environ.get("AWS_REGION", "us-west-2")
@@ -1,15 +1,36 @@
 import json
-import os
-from chatbot import Chatbot
-from dotenv import load_dotenv
-
-try:
-    from langchain_openai import ChatOpenAI
-except ImportError:
-    from langchain.chat_models import ChatOpenAI
+from chatbot import Chatbot, get_shared_chat_model
 from typing import Optional
 
-load_dotenv()
+# システムプロンプトの固定部分。プロバイダー側のプロンプトキャッシュが効くよう、
+# 企画や技術仕様などの可変部分より前に置き、プロジェクトをまたいで同じ内容にする
+_ISSUE_TITLE_INSTRUCTIONS = """
+        あなたは企画と技術仕様からエンジニアが実行可能な具体的なイシュータイトルを生成するアシスタントです
+        ユーザーのメッセージと現在のチケットの内容をもとに、イシューの追加や削除の提案をしてください
+
+        イシューは具体的にエンジニアが何をすべきなのかがわかるようにしてください
+        例えば、以下のようなイシューはNGです
+        - 「ユーザー登録機能を実装する」
+        - 「ユーザー登録機能のUIを作成する」
+        以下のようなイシューはOKです
+        - 「バックエンド：ユーザー登録を行うAPIの作成」
+        - 「フロントエンド：ユーザー登録画面の作成」
+
+        ## output
+        - ユーザーへのメッセージの後に「===============」を出力しイシューの指示を記載
+        - 1行ごとに以下の指示のみを出力します
+        - + <イシュータイトル> はイシューの追加を示します
+        - - <issue_id> はイシューの削除を示します
+"""
+
+_ISSUE_CONTENT_INSTRUCTIONS = """
+        あなたは企画と技術仕様とイシュータイトルからエンジニアが実行可能な具体的なイシュー内容を生成するアシスタントです
+        イシューは具体的にエンジニアが何をすべきなのかがわかるようにしてください
+        内容はINVEST原則に従ってください
+
+        ## output
+        - ユーザーへのメッセージの後に「===============」を出力しイシューの内容を記載
+"""
 
 
 class IssueTitleGenerator(Chatbot):
@@ -28,33 +49,11 @@ class IssueTitleGenerator(Chatbot):
         """
         モデルのプロパティを取得する抽象メソッド。
         """
-        return ChatOpenAI(
-            model="gpt-4o-mini",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            streaming=True,
-            temperature=0.7,
-        )
+        return get_shared_chat_model()
 
     @property
     def _SYSTEM_MESSAGE_PROMPT(self) -> str:
-        return f"""
-        あなたは企画と技術仕様からエンジニアが実行可能な具体的なイシュータイトルを生成するアシスタントです
-        ユーザーのメッセージと現在のチケットの内容をもとに、イシューの追加や削除の提案をしてください
-
-        イシューは具体的にエンジニアが何をすべきなのかがわかるようにしてください
-        例えば、以下のようなイシューはNGです
-        - 「ユーザー登録機能を実装する」
-        - 「ユーザー登録機能のUIを作成する」
-        以下のようなイシューはOKです
-        - 「バックエンド：ユーザー登録を行うAPIの作成」
-        - 「フロントエンド：ユーザー登録画面の作成」
-
-        ## output
-        - ユーザーへのメッセージの後に「===============」を出力しイシューの指示を記載
-        - 1行ごとに以下の指示のみを出力します
-        - + <イシュータイトル> はイシューの追加を示します
-        - - <issue_id> はイシューの削除を示します
-
+        return f"""{_ISSUE_TITLE_INSTRUCTIONS}
         ## 企画
         {self.__plan}
         ## 技術仕様
@@ -107,23 +106,11 @@ class IssueContentGenerator(Chatbot):
         """
         モデルのプロパティを取得する抽象メソッド。
         """
-        return ChatOpenAI(
-            model="gpt-4o-mini",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            streaming=True,
-            temperature=0.7,
-        )
+        return get_shared_chat_model()
 
     @property
     def _SYSTEM_MESSAGE_PROMPT(self) -> str:
-        return f"""
-        あなたは企画と技術仕様とイシュータイトルからエンジニアが実行可能な具体的なイシュー内容を生成するアシスタントです
-        イシューは具体的にエンジニアが何をすべきなのかがわかるようにしてください
-        内容はINVEST原則に従ってください
-
-        ## output
-        - ユーザーへのメッセージの後に「===============」を出力しイシューの内容を記載
-
+        return f"""{_ISSUE_CONTENT_INSTRUCTIONS}
         ## 企画
         {self.__plan}
         ## 技術仕様
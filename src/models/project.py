@@ -1,6 +1,6 @@
 from __future__ import annotations
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from routers.utils import get_project_repository
 from repositories.data.projects import ProjectRepository
 from typing import Optional, ClassVar, Self
@@ -16,23 +16,13 @@ class Project(BaseModel):
     # クラス変数としてリポジトリを保持（依存性注入用）
     _repository: ClassVar[Optional[ProjectRepository]] = None
 
-    def __init__(self, **data):
-        if "project_id" not in data:
-            data["project_id"] = str(uuid4())
-        if "created_at" not in data:
-            data["created_at"] = datetime.now()
-        if "updated_at" not in data:
-            data["updated_at"] = datetime.now()
-        if "last_opened_at" not in data:
-            data["last_opened_at"] = datetime.now()
-        super().__init__(**data)
-
-    project_id: str
+    # 省略時の値はインスタンスごとに生成する
+    project_id: str = Field(default_factory=lambda: str(uuid4()))
     title: str
     github_project_id: Optional[str] = None
-    created_at: datetime
-    updated_at: datetime
-    last_opened_at: datetime
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    last_opened_at: datetime = Field(default_factory=datetime.now)
     
     @classmethod
     def set_repository(cls, repository: ProjectRepository) -> None:
@@ -1,6 +1,6 @@
-import json
 import logging
 import os
+import orjson
 from chatbot import Chatbot
 from fastapi import APIRouter, HTTPException, status
 from fastapi.responses import StreamingResponse
@@ -19,6 +19,28 @@ router = APIRouter()
 
 logger = logging.getLogger("uvicorn")
 
+_SEPARATOR = "==============="
+# json.dumps({key: text}, ensure_ascii=False) + "\\n" と同じバイト列を組み立てる
+_MESSAGE_PREFIX = b'{"message": '
+_FILE_PREFIX = b'{"file": '
+# 行の区切り (従来どおり閉じ括弧の後にバックスラッシュと n の2文字)
+_LINE_SUFFIX = b"}\\n"
+
+
+def _encode_line(prefix: bytes, text: str) -> bytes:
+    # orjson は文字列を json.dumps(ensure_ascii=False) と同じ形式でエスケープし、
+    # UTF-8のバイト列を直接返すため、送信前のエンコードが不要になる
+    return prefix + orjson.dumps(text) + _LINE_SUFFIX
+
+
+def _partial_separator_length(buffer: str) -> int:
+    """バッファ末尾が区切り文字列の先頭と一致している長さを返す"""
+    for length in range(min(len(buffer), len(_SEPARATOR) - 1), 0, -1):
+        if buffer.endswith(_SEPARATOR[:length]):
+            return length
+    return 0
+
+
 async def process_stream(bot: Chatbot, message: str, history: list = None, **kwargs):
     """
     Processes the bot stream and yields JSON chunks.
@@ -28,56 +50,53 @@ async def process_stream(bot: Chatbot, message: str, history: list = None, **kwa
     if DEBUG:
         logger.info(f"Processing stream with message: {message}")
     all_chunks: list[str] = []
+    # 区切り文字列の途中で終わっている可能性のある末尾だけを保持する
     buffer = ""
     is_file_content = False
-    separator = "==============="
 
     async for chunk in bot.stream(message, history=history, **kwargs):
-        buffer += chunk
-        all_chunks.append(chunk)
+        if DEBUG:
+            all_chunks.append(chunk)
 
-        while True:
-            if is_file_content:
-                # If we are in file content mode, yield the entire buffer as file content
-                if buffer:
-                    yield json.dumps({"file": buffer}, ensure_ascii=False) + "\\n"
-                    buffer = ""
-                # Since we yielded the whole buffer, break the inner loop
-                break
+        if is_file_content:
+            if chunk:
+                yield _encode_line(_FILE_PREFIX, chunk)
+            continue
 
-            separator_index = buffer.find(separator)
-            if separator_index != -1:
-                # Yield the part before the separator as a message
-                message_part = buffer[:separator_index]
-                if message_part:
-                    yield json.dumps(
-                        {"message": message_part}, ensure_ascii=False
-                    ) + "\\n"
+        # 新しく届いた部分 (と区切り文字列をまたぐ可能性のある末尾) だけを検索する
+        scan_from = max(0, len(buffer) - len(_SEPARATOR) + 1)
+        buffer += chunk
+        separator_index = buffer.find(_SEPARATOR, scan_from)
+        if separator_index != -1:
+            # Yield the part before the separator as a message
+            message_part = buffer[:separator_index]
+            if message_part:
+                yield _encode_line(_MESSAGE_PREFIX, message_part)
 
-                # Remove the message part and the separator from the buffer
-                buffer = buffer[separator_index + len(separator) :]
-                # Remove leading newline if present after separator
-                if buffer.startswith("\\n"):
-                    buffer = buffer[1:]
+            # Switch to file content mode
+            is_file_content = True
+            file_part = buffer[separator_index + len(_SEPARATOR) :]
+            buffer = ""
+            # Remove leading newline if present after separator
+            # (従来どおりバックスラッシュと n の2文字を判定するため、実際の改行はファイル側に残る)
+            if file_part.startswith("\\n"):
+                file_part = file_part[1:]
+            if file_part:
+                yield _encode_line(_FILE_PREFIX, file_part)
+            continue
 
-                # Switch to file content mode
-                is_file_content = True
-                # Continue the inner loop to process the remaining buffer in file mode immediately
-                continue  # Explicitly continue to re-evaluate the buffer in the new mode
-            else:
-                # If no separator is found and not in file content mode,
-                # yield the entire buffer as a message if it's not empty
-                if buffer and not is_file_content:
-                    yield json.dumps({"message": buffer}, ensure_ascii=False) + "\\n"
-                    buffer = ""  # Clear buffer after yielding
-                # Break the inner loop as there's nothing more to process without a separator
-                break
+        # 区切り文字列の先頭になり得る末尾以外をメッセージとして送る
+        pending = _partial_separator_length(buffer)
+        message_part = buffer[: len(buffer) - pending]
+        if message_part:
+            yield _encode_line(_MESSAGE_PREFIX, message_part)
+            buffer = buffer[len(buffer) - pending :]
 
     # After the stream ends, yield any remaining buffer content
     if buffer:
-        key = "file" if is_file_content else "message"
-        yield json.dumps({key: buffer}, ensure_ascii=False) + "\\n"
-    
+        prefix = _FILE_PREFIX if is_file_content else _MESSAGE_PREFIX
+        yield _encode_line(prefix, buffer)
+
     if DEBUG:
         logger.info(f"Output: {''.join(all_chunks)}")
 
@@ -16,12 +16,17 @@ _project_repository_instance = None
 
 DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "t")
 
-def get_project_repository() -> ProjectRepository:
-    """Returns a singleton instance of the DynamoDbProjectRepository."""
+def get_project_repository(initialize: bool = True) -> ProjectRepository:
+    """
+    Returns a singleton instance of the DynamoDbProjectRepository.
+
+    initialize=False の場合はテーブルの初期化を呼び出し元に任せる (起動時にスレッドで実行するため)。
+    """
     global _project_repository_instance
     if _project_repository_instance is None:
         _project_repository_instance = DynamoDbProjectRepository()
-        _project_repository_instance.initialize("Projects")
+        if initialize:
+            _project_repository_instance.initialize("Projects")
     return _project_repository_instance
 
 
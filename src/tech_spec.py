@@ -1,15 +1,6 @@
-import os
-from chatbot import Chatbot
+from chatbot import Chatbot, get_shared_chat_model
 from typing import Optional
 
-try:
-    from langchain_openai import ChatOpenAI
-except ImportError:
-    from langchain.chat_models import ChatOpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
-
 
 class TechSpecBot(Chatbot):
     """
@@ -25,12 +16,7 @@ class TechSpecBot(Chatbot):
         """
         モデルのプロパティを取得する抽象メソッド。
         """
-        return ChatOpenAI(
-            model="gpt-4o-mini",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            streaming=True,
-            temperature=0.7,
-        )
+        return get_shared_chat_model()
 
     @property
     def _SYSTEM_MESSAGE_PROMPT(self) -> str:
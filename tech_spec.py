@@ -1,14 +1,18 @@
 import os
+from functools import cached_property
 from chatbot import Chatbot
-from typing import Optional
+from langchain_core.messages import BaseMessage
+from typing import Optional, Sequence, Union
 
 try:
     from langchain_openai import ChatOpenAI
 except ImportError:
     from langchain.chat_models import ChatOpenAI
-from dotenv import load_dotenv
+from env_utils import load_env_once
 
-load_dotenv()
+load_env_once()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 
 class TechSpecBot(Chatbot):
@@ -21,14 +25,14 @@ class TechSpecBot(Chatbot):
         super().__init__()
         self.__last_message: Optional[str] = None
 
-    @property
+    @cached_property
     def _model(self):
         """
         モデルのプロパティを取得する抽象メソッド。
         """
         return ChatOpenAI(
             model="gpt-4o-mini",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            openai_api_key=OPENAI_API_KEY,
             streaming=True,
             temperature=0.7,
         )
@@ -57,7 +61,12 @@ class TechSpecBot(Chatbot):
         {self.__plan}
         """
 
-    async def stream(self, user_message: str, history: list = None, **kwargs):
+    async def stream(
+        self,
+        user_message: str,
+        history: Optional[Sequence[Union[BaseMessage, dict]]] = None,
+        **kwargs,
+    ):
         response = ""
         content = kwargs.get("content", "")
         # Remove 'content' and 'history' from kwargs if they exist,
@@ -72,6 +72,18 @@ class TestProject:
             assert saved_project_data is not None
             assert saved_project_data["title"] == "新規プロジェクト"
 
+    def test_default_values_are_generated_per_instance(self):
+        """省略したIDと日時がインスタンスごとに生成されることをテスト"""
+        before = datetime.now()
+        first = Project(title="プロジェクト1")
+        second = Project(title="プロジェクト2")
+
+        # IDはインスタンスごとに異なる
+        assert first.project_id != second.project_id
+        # 日時は生成時点の値が設定される
+        assert first.created_at >= before
+        assert second.last_opened_at >= first.updated_at
+
     def test_save_updates_existing_project_in_repository(self):
         """save メソッドが既存のプロジェクトを更新することをテスト"""
         # プロジェクトを作成して保存
@@ -0,0 +1,116 @@
+import asyncio
+import json
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from src.routers.chat import (
+        _FILE_PREFIX,
+        _MESSAGE_PREFIX,
+        _encode_line,
+        process_stream,
+    )
+else:
+    from routers.chat import (
+        _FILE_PREFIX,
+        _MESSAGE_PREFIX,
+        _encode_line,
+        process_stream,
+    )
+
+
+class FakeStreamBot:
+    """決められたチャンクを順に返すテスト用のボット"""
+
+    def __init__(self, chunks: list[str]):
+        self.chunks = chunks
+
+    async def stream(self, message: str, history: list = None, **kwargs):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def run_process_stream(chunks: list[str]) -> list[dict]:
+    """process_stream の出力を行ごとにデコードして返すヘルパー"""
+
+    async def collect() -> list:
+        return [line async for line in process_stream(FakeStreamBot(chunks), "msg")]
+
+    lines = asyncio.run(collect())
+    decoded = []
+    for line in lines:
+        # 各行は JSON の後ろにバックスラッシュと n の2文字が続く
+        assert line.endswith(b"\\n")
+        decoded.append(json.loads(line[: -len(b"\\n")]))
+    return decoded
+
+
+def join_key(lines: list[dict], key: str) -> str:
+    """指定したキーの値を連結するヘルパー"""
+    return "".join(line[key] for line in lines if key in line)
+
+
+class TestProcessStream:
+    """process_stream のテストクラス"""
+
+    def test_separator_split_across_chunks(self):
+        """区切り文字列が2つのチャンクにまたがっても検出されること"""
+        lines = run_process_stream(["回答です", "=====", "==========\n企画の内容"])
+
+        assert join_key(lines, "message") == "回答です"
+        assert join_key(lines, "file") == "\n企画の内容"
+        # 区切り文字列の断片はメッセージとして送られないこと
+        assert all("=" not in line.get("message", "") for line in lines)
+
+    def test_newline_after_separator_is_kept(self):
+        """区切り文字列直後の改行は読み飛ばされず、ファイルの内容に残ること"""
+        lines = run_process_stream(["回答===============\n内容", "の続き"])
+
+        assert join_key(lines, "message") == "回答"
+        assert join_key(lines, "file") == "\n内容の続き"
+
+    def test_newline_after_separator_in_next_chunk(self):
+        """区切り文字列直後の改行が次のチャンクにある場合もファイルの内容に残ること"""
+        lines = run_process_stream(["回答===============", "\n内容", "の続き"])
+
+        assert join_key(lines, "message") == "回答"
+        assert join_key(lines, "file") == "\n内容の続き"
+
+    def test_trailing_partial_separator_at_end_of_stream(self):
+        """区切り文字列の途中で終わった場合、残りはメッセージとして送られること"""
+        lines = run_process_stream(["回答です", "====="])
+
+        assert join_key(lines, "message") == "回答です====="
+        assert join_key(lines, "file") == ""
+
+    def test_non_ascii_and_escaped_content(self):
+        """日本語や引用符、バックスラッシュ、制御文字を含む内容が正しく往復すること"""
+        message = '日本語の "引用" と \\ バックスラッシュ\tタブ'
+        file_content = '{"key": "値"}\n改行\\n'
+        lines = run_process_stream([message, "===============\n", file_content])
+
+        assert join_key(lines, "message") == message
+        assert join_key(lines, "file") == "\n" + file_content
+
+
+class TestEncodeLine:
+    """_encode_line のテストクラス"""
+
+    def test_matches_json_dumps_output(self):
+        """従来の json.dumps を使った出力とバイト列が完全に一致すること"""
+        texts = [
+            "plain",
+            '引用 "quoted" と \\ バックスラッシュ',
+            "改行\nタブ\t復帰\r",
+            "".join(chr(i) for i in range(0x20)),
+            "絵文字 \U0001F600",
+            "",
+        ]
+        for prefix, key in ((_MESSAGE_PREFIX, "message"), (_FILE_PREFIX, "file")):
+            for text in texts:
+                expected = json.dumps({key: text}, ensure_ascii=False) + "\\n"
+                assert _encode_line(prefix, text) == expected.encode()
+
+    def test_line_ends_with_literal_backslash_n(self):
+        """行末が改行文字ではなく、バックスラッシュと n の2文字であること"""
+        assert _encode_line(_MESSAGE_PREFIX, "a") == b'{"message": "a"}\\n'
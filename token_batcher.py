@@ -0,0 +1,47 @@
+import time
+
+import chainlit as cl
+
+
+class TokenBatcher:
+    """
+    ストリーミング中のトークンをまとめてからメッセージに送るクラス。
+
+    1トークンごとに stream_token を呼ぶとWebSocketのフレームが大量に発生するため、
+    一定の文字数がたまるか、前回の送信から一定時間が経過した時点でまとめて送る。
+    """
+
+    def __init__(self, msg: cl.Message, min_chars: int = 64, max_delay: float = 0.03):
+        """
+        Args:
+            msg: トークンを送る先のメッセージ。
+            min_chars: この文字数がたまったら送信する。
+            max_delay: 前回の送信からこの秒数が経過していたら送信する。
+        """
+        self._msg = msg
+        self._min_chars = min_chars
+        self._max_delay = max_delay
+        self._buffer: list[str] = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    async def push(self, token: str) -> None:
+        """トークンをバッファに追加し、条件を満たしていれば送信する"""
+        if not token:
+            return
+        self._buffer.append(token)
+        self._size += len(token)
+        if (
+            self._size >= self._min_chars
+            or time.monotonic() - self._last_flush >= self._max_delay
+        ):
+            await self.flush()
+
+    async def flush(self) -> None:
+        """バッファに残っているトークンをすべて送信する"""
+        if self._buffer:
+            token = "".join(self._buffer)
+            self._buffer.clear()
+            self._size = 0
+            await self._msg.stream_token(token)
+        self._last_flush = time.monotonic()